@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import math
+from datetime import timedelta
+from statistics import NormalDist
+from prometheus_client import REGISTRY
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from config import ANALYTICS_ROLLUPS, ANALYTICS_INTERVAL, ANALYTICS_LAG, ANALYTICS_CHUNK
+from db import async_session_maker
+from metrics import StatsCollector
+from models import ClaimedPrize, Prize, Lootbox, DropRollup, AnalyticsWatermark
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_WATERMARK = 'drop_rollups'
+
+
+def wilson_interval(successes: int, trials: int, z: float) -> tuple[float, float]:
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def chi_square_p_value(statistic: float, degrees_of_freedom: int) -> float:
+    """
+    Верхний хвост хи-квадрат через приближение Уилсона–Хилферти; для df >= 1 точности хватает для флагов.
+    """
+    k = degrees_of_freedom
+    z = ((statistic / k) ** (1 / 3) - (1 - 2 / (9 * k))) / math.sqrt(2 / (9 * k))
+    return 1 - NormalDist().cdf(z)
+
+
+class DropRollupAggregator:
+    """
+    Инкрементально сворачивает claimed_prizes в почасовые drop_rollups по водяному знаку на claimed_prizes.id.
+
+    Проход берёт строки с id выше водяного знака, но не новее lag секунд: id выдаются до коммита,
+    и строка параллельной транзакции с меньшим id иначе могла бы проскочить мимо агрегата.
+    Водяной знак и агрегаты обновляются в одной транзакции, строка водяного знака блокируется
+    через SKIP LOCKED, поэтому воркеры не считают одни и те же строки дважды.
+    Выручка и выплаты считаются по ценам на момент агрегации, то есть с отставанием не больше одного прохода.
+    """
+
+    def __init__(
+            self,
+            session_maker: async_sessionmaker[AsyncSession],
+            enabled: bool,
+            interval: float,
+            lag: int,
+            chunk: int
+    ):
+        self.session_maker = session_maker
+        self.enabled = enabled
+        self.interval = interval
+        self.lag = lag
+        self.chunk = chunk
+        self._task: asyncio.Task | None = None
+
+        self.passes = 0
+        self.failed_passes = 0
+        self.last_id = 0
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'passes': self.passes,
+            'failed_passes': self.failed_passes,
+            'last_id': self.last_id,
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                while await self.aggregate() == self.chunk:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed_passes += 1
+                logger.exception("Drop rollup pass failed")
+            await asyncio.sleep(self.interval)
+
+    async def aggregate(self) -> int:
+        """
+        Один шаг агрегации по диапазону не шире chunk id.
+
+        :return ширина обработанного диапазона id; равна chunk, если отставание ещё не выбрано
+        """
+        async with self.session_maker() as s:
+            await s.execute(
+                pg_insert(AnalyticsWatermark)
+                .values(name=ROLLUP_WATERMARK, last_id=0)
+                .on_conflict_do_nothing(index_elements=[AnalyticsWatermark.name])
+            )
+            await s.commit()
+            watermark = await s.scalar(
+                select(AnalyticsWatermark)
+                .filter(AnalyticsWatermark.name == ROLLUP_WATERMARK)
+                .with_for_update(skip_locked=True)
+            )
+            if watermark is None:
+                return 0
+
+            low = watermark.last_id
+            settled = await s.scalar(
+                select(func.max(ClaimedPrize.id))
+                .filter(ClaimedPrize.id > low, ClaimedPrize.claim_date < func.now() - timedelta(seconds=self.lag))
+            )
+            if settled is None:
+                await s.rollback()
+                return 0
+            high = min(settled, low + self.chunk)
+
+            hour = func.date_trunc('hour', ClaimedPrize.claim_date)
+            totals = (
+                select(
+                    hour,
+                    ClaimedPrize.prize_id,
+                    Prize.lootbox_id,
+                    func.count(),
+                    func.sum(Lootbox.open_price),
+                    func.sum(Prize.tokens_amount)
+                )
+                .join(Prize, Prize.id == ClaimedPrize.prize_id)
+                .join(Lootbox, Lootbox.id == Prize.lootbox_id)
+                .filter(ClaimedPrize.id > low, ClaimedPrize.id <= high)
+                .group_by(hour, ClaimedPrize.prize_id, Prize.lootbox_id)
+            )
+            stmt = pg_insert(DropRollup).from_select(
+                ['hour', 'prize_id', 'lootbox_id', 'opens', 'revenue', 'payout'], totals
+            )
+            await s.execute(stmt.on_conflict_do_update(
+                index_elements=[DropRollup.hour, DropRollup.prize_id],
+                set_={
+                    'opens': DropRollup.opens + stmt.excluded.opens,
+                    'revenue': DropRollup.revenue + stmt.excluded.revenue,
+                    'payout': DropRollup.payout + stmt.excluded.payout,
+                }
+            ))
+            watermark.last_id = high
+            watermark.updated_at = func.now()
+            await s.commit()
+
+        self.passes += 1
+        self.last_id = high
+        return high - low
+
+
+drop_rollups = DropRollupAggregator(
+    async_session_maker, ANALYTICS_ROLLUPS, ANALYTICS_INTERVAL, ANALYTICS_LAG, ANALYTICS_CHUNK
+)
+REGISTRY.register(StatsCollector('drop_rollups', drop_rollups.stats))
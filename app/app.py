@@ -1,22 +1,68 @@
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, UploadFile
+import asyncio
+import json
+from datetime import datetime
+from typing import Literal
+from contextlib import asynccontextmanager, aclosing
+from fastapi import FastAPI, Depends, UploadFile, Request, Response, Query, HTTPException, WebSocket, \
+    WebSocketDisconnect
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse, JSONResponse
+from pydantic import ValidationError
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.middleware.cors import CORSMiddleware
-from web3_layer import generate_ton_payload, verify_ton_proof
-from service import get_all_lootboxes, open_lootbox, get_or_create_user, get_all_prizes, create_prize, create_lootbox, \
-    upload_lootbox_image, get_user_claimed_prizes
-from db import get_async_session
+from web3_layer import generate_ton_payload, ton_proof_verifier
+from service import get_lootbox_catalog, open_lootbox, get_or_create_user, get_all_prizes, create_prize, create_lootbox, \
+    upload_lootbox_image, get_user_claimed_prizes, open_lootbox_batch, simulate_existing_lootbox, simulate_draft_lootbox, \
+    import_catalog, iter_catalog, get_user_stats, get_nft_delivery_counts, retry_failed_nft_deliveries, \
+    get_drop_rate_report, get_lootbox_timeseries
+from db import get_async_session, get_read_session
 from models import User
 from schemas import TonProofItem, AuthResponse, LootboxReadSchema, LootboxOpenSchema, PrizeReadSchema, UserReadSchema, \
-    PrizeCreateSchema, LootboxCreateSchema, ClaimedPrizeReadSchema, TonPayload
-from users import get_current_user, create_jwt, get_admin_user
-from db import create_db_and_tables
+    PrizeCreateSchema, LootboxCreateSchema, ClaimedPrizeReadSchema, TonPayload, LootboxOpenBatchSchema, \
+    SimulationParamsSchema, SimulationDraftSchema, SimulationResultSchema, CatalogSchema, CatalogImportResultSchema, \
+    UserStatsReadSchema, DropSchema, LootboxDropRateSchema, LootboxTimeseriesSchema
+from users import get_current_user, create_jwt, get_admin_user, get_user_read_session
+from config import CATALOG_MAX_AGE, CLAIMED_PRIZES_PAGE_SIZE, CLAIMED_PRIZES_PAGE_MAX, DROP_FEED_PING, \
+    INVALIDATION_CONNECT_WAIT, PrizeQualityEnum, PrizeTypeEnum
+from migrations import check_schema_version
+from claim_log import claim_log
+from images import shutdown_image_pool
+from metrics import MetricsMiddleware
+from catalog_io import parse_catalog, dump_catalog_csv, dump_catalog_json
+from invalidation import bus
+from drops import drop_feed
+from nft import nft_worker
+from analytics import drop_rollups
+from partitions import claim_partitions
+from warmup import warmup
+from profiler import ProfilerMiddleware, profile_store
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await create_db_and_tables()
+    await check_schema_version()
+    if bus.enabled:
+        # Слушатель до прогрева: инвалидации, пришедшие во время прогрева, не теряются
+        bus.start()
+        await bus.wait_listening(INVALIDATION_CONNECT_WAIT)
+    await warmup.run()
+    claim_partitions.start()
+    if claim_log.enabled:
+        claim_log.start()
+    nft_worker.start()
+    if drop_rollups.enabled:
+        drop_rollups.start()
+    warmup.ready = True
     yield
+    warmup.ready = False
+    await drop_rollups.stop()
+    await nft_worker.stop()
+    await bus.stop()
+    await claim_log.stop()
+    await claim_partitions.stop()
+    shutdown_image_pool()
+    ton_proof_verifier.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -35,7 +81,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Profile-Id"],
 )
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get('/ready', include_in_schema=False)
+async def get_readiness():
+    return JSONResponse(warmup.stats(), status_code=200 if warmup.ready else 503)
 
 
 @app.get("/auth/payload", response_model=TonPayload, tags=['users'])
@@ -45,7 +104,7 @@ async def get_payload():
 
 @app.post("/auth/verify", response_model=AuthResponse, tags=['users'])
 async def verify_signature(data: TonProofItem, s: AsyncSession = Depends(get_async_session)):
-    address = verify_ton_proof(data)
+    address = await ton_proof_verifier.verify(data)
     await get_or_create_user(s, address)
     token = create_jwt(address)
     return AuthResponse(access_token=token, token_type='bearer')
@@ -56,13 +115,69 @@ async def get_user(user: User = Depends(get_current_user)):
     return user
 
 
+@app.get('/users/me/stats', response_model=UserStatsReadSchema, tags=['users'])
+async def get_stats(s: AsyncSession = Depends(get_user_read_session), user: User = Depends(get_current_user)):
+    return await get_user_stats(s, user)
+
+
 @app.get('/users/claimed_prizes', response_model=list[ClaimedPrizeReadSchema], tags=['users'])
-async def get_claimed_prizes(s: AsyncSession = Depends(get_async_session), user: User = Depends(get_current_user)):
-    return await get_user_claimed_prizes(s, user)
+async def get_claimed_prizes(
+        response: Response,
+        limit: int = Query(CLAIMED_PRIZES_PAGE_SIZE, gt=0, le=CLAIMED_PRIZES_PAGE_MAX),
+        cursor: str | None = None,
+        quality: PrizeQualityEnum | None = None,
+        type: PrizeTypeEnum | None = None,
+        s: AsyncSession = Depends(get_user_read_session),
+        user: User = Depends(get_current_user)
+):
+    claimed_prizes, next_cursor = await get_user_claimed_prizes(s, user, limit, cursor, quality, type)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return claimed_prizes
+
+
+@app.get('/drops', response_model=list[DropSchema], tags=['drops'])
+async def get_recent_drops():
+    return Response(content=f'[{",".join(drop_feed.recent)}]', media_type='application/json')
+
+
+@app.get('/drops/stream', tags=['drops'])
+async def get_drops_stream():
+    async def events():
+        async for message in drop_feed.listen(DROP_FEED_PING):
+            yield ': ping\n\n' if message is None else f'data: {message}\n\n'
+
+    return StreamingResponse(
+        events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def wait_disconnect(websocket: WebSocket):
+    while (await websocket.receive())['type'] != 'websocket.disconnect':
+        pass
+
+
+@app.websocket('/drops/ws')
+async def drops_websocket(websocket: WebSocket):
+    await websocket.accept()
+    # Клиент ничего не шлёт, поэтому об отключении без дропов узнаём только из receive(): проверяем на каждом ping
+    disconnected = asyncio.create_task(wait_disconnect(websocket))
+    try:
+        async with aclosing(drop_feed.listen(DROP_FEED_PING)) as messages:
+            async for message in messages:
+                if disconnected.done():
+                    return
+                if message is not None:
+                    await websocket.send_text(message)
+    except WebSocketDisconnect:
+        return
+    finally:
+        disconnected.cancel()
+    await websocket.close(code=1013)
 
 
 @app.get('/prizes', response_model=list[PrizeReadSchema], tags=['prizes'])
-async def get_prizes_list(user: User = Depends(get_admin_user), s: AsyncSession = Depends(get_async_session)):
+async def get_prizes_list(user: User = Depends(get_admin_user), s: AsyncSession = Depends(get_user_read_session)):
     return await get_all_prizes(s)
 
 
@@ -76,8 +191,13 @@ async def post_create_prize(
 
 
 @app.get('/lootboxes', response_model=list[LootboxReadSchema], tags=['lootboxes'])
-async def get_lootboxes_list(s: AsyncSession = Depends(get_async_session)):
-    return await get_all_lootboxes(s)
+async def get_lootboxes_list(request: Request, s: AsyncSession = Depends(get_async_session)):
+    # Снимок пересобирается только сразу после инвалидации, то есть после записи: реплика могла её ещё не получить
+    catalog = await get_lootbox_catalog(s)
+    headers = {'ETag': catalog.etag, 'Cache-Control': f'public, max-age={CATALOG_MAX_AGE}'}
+    if catalog.matches(request.headers.get('if-none-match')):
+        return Response(status_code=304, headers=headers)
+    return Response(content=catalog.body, media_type='application/json', headers=headers)
 
 
 @app.post('/lootboxes', response_model=LootboxReadSchema, tags=['lootboxes'])
@@ -89,6 +209,51 @@ async def post_create_lootbox(
     return await create_lootbox(s, schema)
 
 
+@app.post(
+    '/lootboxes/bulk',
+    response_model=CatalogImportResultSchema,
+    tags=['lootboxes'],
+    openapi_extra={'requestBody': {'required': True, 'content': {
+        'application/json': {'schema': CatalogSchema.model_json_schema()},
+        'text/csv': {'schema': {'type': 'string'}},
+    }}}
+)
+async def post_import_catalog(
+        request: Request,
+        user: User = Depends(get_admin_user),
+        s: AsyncSession = Depends(get_async_session)
+):
+    try:
+        catalog = parse_catalog(await request.body(), request.headers.get('content-type', ''))
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except (KeyError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid catalog: {e}")
+    return await import_catalog(s, catalog)
+
+
+@app.get('/lootboxes/export', tags=['lootboxes'])
+async def get_export_catalog(format: Literal['json', 'csv'] = 'json', user: User = Depends(get_admin_user)):
+    if format == 'csv':
+        return StreamingResponse(dump_catalog_csv(iter_catalog()), media_type='text/csv')
+    return StreamingResponse(dump_catalog_json(iter_catalog()), media_type='application/json')
+
+
+@app.post('/lootboxes/simulate', response_model=SimulationResultSchema, tags=['lootboxes'])
+async def post_simulate_draft_lootbox(schema: SimulationDraftSchema, user: User = Depends(get_admin_user)):
+    return await simulate_draft_lootbox(schema)
+
+
+@app.get('/lootboxes/{lootbox_id}/simulate', response_model=SimulationResultSchema, tags=['lootboxes'])
+async def get_simulate_lootbox(
+        lootbox_id: int,
+        params: SimulationParamsSchema = Depends(),
+        user: User = Depends(get_admin_user),
+        s: AsyncSession = Depends(get_async_session)
+):
+    return await simulate_existing_lootbox(s, lootbox_id, params)
+
+
 @app.post('/lootboxes/{lootbox_id}/upload_image', response_model=LootboxReadSchema, tags=['lootboxes'])
 async def post_upload_lootbox_image(
         lootbox_id: int,
@@ -105,4 +270,78 @@ async def post_open_lootbox(
         user: User = Depends(get_current_user),
         s: AsyncSession = Depends(get_async_session)
 ):
-    return await open_lootbox(schema, user, s)
\ No newline at end of file
+    return await open_lootbox(schema, user, s)
+
+
+@app.post('/lootboxes/open_batch', response_model=list[PrizeReadSchema], tags=['lootboxes'])
+async def post_open_lootbox_batch(
+        schema: LootboxOpenBatchSchema,
+        user: User = Depends(get_current_user),
+        s: AsyncSession = Depends(get_async_session)
+):
+    return await open_lootbox_batch(schema, user, s)
+
+
+@app.get('/admin/claim_log', tags=['admin'])
+async def get_claim_log_stats(user: User = Depends(get_admin_user)):
+    return claim_log.stats()
+
+
+@app.get('/admin/nft_deliveries', tags=['admin'])
+async def get_nft_deliveries_stats(user: User = Depends(get_admin_user), s: AsyncSession = Depends(get_async_session)):
+    return {**nft_worker.stats(), 'statuses': await get_nft_delivery_counts(s)}
+
+
+@app.post('/admin/nft_deliveries/retry', tags=['admin'])
+async def post_retry_nft_deliveries(user: User = Depends(get_admin_user), s: AsyncSession = Depends(get_async_session)):
+    return {'requeued': await retry_failed_nft_deliveries(s)}
+
+
+@app.get('/admin/analytics/drop_rates', response_model=list[LootboxDropRateSchema], tags=['admin'])
+async def get_drop_rates(
+        lootbox_id: int | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        user: User = Depends(get_admin_user),
+        s: AsyncSession = Depends(get_read_session)
+):
+    return await get_drop_rate_report(s, lootbox_id, since, until)
+
+
+@app.get('/admin/analytics/lootboxes/{lootbox_id}/timeseries', response_model=LootboxTimeseriesSchema, tags=['admin'])
+async def get_timeseries(
+        lootbox_id: int,
+        bucket: Literal['hour', 'day'] = 'hour',
+        since: datetime | None = None,
+        until: datetime | None = None,
+        user: User = Depends(get_admin_user),
+        s: AsyncSession = Depends(get_read_session)
+):
+    return await get_lootbox_timeseries(s, lootbox_id, bucket, since, until)
+
+
+@app.get('/admin/profiles', tags=['admin'])
+async def get_profiles(user: User = Depends(get_admin_user)):
+    return profile_store.list()
+
+
+@app.get('/admin/profiles/{profile_id}', tags=['admin'])
+async def get_profile(
+        profile_id: str,
+        format: Literal['speedscope', 'pstats'] = 'speedscope',
+        user: User = Depends(get_admin_user)
+):
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == 'pstats':
+        return Response(
+            content=profile.to_pstats(),
+            media_type='application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename="{profile_id}.prof"'}
+        )
+    return Response(
+        content=json.dumps(profile.to_speedscope()),
+        media_type='application/json',
+        headers={'Content-Disposition': f'attachment; filename="{profile_id}.speedscope.json"'}
+    )
@@ -0,0 +1,51 @@
+import hashlib
+from typing import Sequence
+from pydantic import TypeAdapter
+from models import Lootbox
+from schemas import LootboxReadSchema
+
+lootbox_list_adapter = TypeAdapter(list[LootboxReadSchema])
+
+
+class CatalogSnapshot:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    def matches(self, if_none_match: str | None) -> bool:
+        if not if_none_match:
+            return False
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or self.etag in tags
+
+
+_snapshot: CatalogSnapshot | None = None
+_generation = 0
+
+
+def build_catalog(lootboxes: Sequence[Lootbox]) -> CatalogSnapshot:
+    schemas = lootbox_list_adapter.validate_python(lootboxes, from_attributes=True)
+    return CatalogSnapshot(lootbox_list_adapter.dump_json(schemas))
+
+
+def get_cached_catalog() -> CatalogSnapshot | None:
+    return _snapshot
+
+
+def catalog_generation() -> int:
+    return _generation
+
+
+def cache_catalog(snapshot: CatalogSnapshot, generation: int):
+    """
+    Сохраняет снимок, только если каталог не инвалидировали, пока он собирался.
+    """
+    global _snapshot
+    if generation == _generation:
+        _snapshot = snapshot
+
+
+def invalidate_catalog():
+    global _snapshot, _generation
+    _generation += 1
+    _snapshot = None
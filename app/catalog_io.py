@@ -0,0 +1,72 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, Iterable
+from schemas import CatalogSchema
+
+CSV_COLUMNS = (
+    'lootbox_name', 'open_price', 'prize_name', 'quality', 'drop_chance', 'type', 'tokens_amount',
+    'user_open_rate', 'global_open_rate'
+)
+
+
+def parse_catalog_csv(text: str) -> CatalogSchema:
+    """
+    Одна строка CSV на приз; строка с пустым prize_name описывает лутбокс без призов.
+    """
+    lootboxes: dict[str, dict] = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        lootbox = lootboxes.setdefault(row['lootbox_name'], {
+            'name': row['lootbox_name'],
+            'open_price': row['open_price'],
+            'user_open_rate': row.get('user_open_rate') or None,
+            'global_open_rate': row.get('global_open_rate') or None,
+            'prizes': []
+        })
+        if row.get('prize_name'):
+            lootbox['prizes'].append({
+                'name': row['prize_name'],
+                'quality': row['quality'],
+                'drop_chance': row['drop_chance'],
+                'type': row['type'],
+                'tokens_amount': row.get('tokens_amount') or 0,
+            })
+    return CatalogSchema.model_validate({'lootboxes': list(lootboxes.values())})
+
+
+def parse_catalog(data: bytes | str, content_type: str) -> CatalogSchema:
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    if 'csv' in content_type:
+        return parse_catalog_csv(data)
+    return CatalogSchema.model_validate_json(data)
+
+
+def format_value(value) -> str:
+    return '' if value is None else str(value)
+
+
+async def dump_catalog_csv(lootboxes: AsyncIterator[dict]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    async for lootbox in lootboxes:
+        prizes: Iterable[dict] = lootbox['prizes'] or [{}]
+        for prize in prizes:
+            writer.writerow([
+                lootbox['name'], lootbox['open_price'], prize.get('name', ''), prize.get('quality', ''),
+                format_value(prize.get('drop_chance')), prize.get('type', ''), format_value(prize.get('tokens_amount')),
+                format_value(lootbox['user_open_rate']), format_value(lootbox['global_open_rate'])
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+async def dump_catalog_json(lootboxes: AsyncIterator[dict]) -> AsyncIterator[str]:
+    yield '{"lootboxes": ['
+    first = True
+    async for lootbox in lootboxes:
+        yield ('' if first else ',') + json.dumps(lootbox, default=str)
+        first = False
+    yield ']}'
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncEngine
+from config import CLAIM_WRITE_BEHIND, CLAIM_LOG_BATCH_SIZE, CLAIM_LOG_FLUSH_INTERVAL, CLAIM_LOG_MAX_QUEUE
+from db import engine
+from metrics import StatsCollector
+from prometheus_client import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ClaimRecord = tuple[int, uuid.UUID, datetime]
+
+
+class ClaimLog:
+    """
+    Write-behind журнал выигранных призов.
+    Записи копятся в очереди и пачками уходят в claimed_prizes через COPY,
+    когда набирается batch_size записей или проходит flush_interval секунд.
+    """
+
+    columns = ('prize_id', 'user_id', 'claim_date')
+
+    def __init__(self, engine: AsyncEngine, enabled: bool, batch_size: int, flush_interval: float, max_queue: int):
+        self.engine = engine
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue[ClaimRecord] = asyncio.Queue(max_queue)
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.backpressure_waits = 0
+        self.backpressure_seconds = 0.0
+
+    async def put(self, records: list[ClaimRecord]):
+        for record in records:
+            if self.queue.full():
+                self.backpressure_waits += 1
+                started = time.perf_counter()
+                await self.queue.put(record)
+                self.backpressure_seconds += time.perf_counter() - started
+            else:
+                self.queue.put_nowait(record)
+            self.enqueued += 1
+
+    def start(self):
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Дожидается, пока очередь будет полностью записана в базу.
+        """
+        if self._task is None:
+            return
+        self._closing = True
+        await self._task
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'queue_size': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'backpressure_waits': self.backpressure_waits,
+            'backpressure_seconds': self.backpressure_seconds,
+        }
+
+    async def _run(self):
+        while not (self._closing and self.queue.empty()):
+            batch = await self._collect()
+            if batch:
+                await self._flush(batch)
+
+    async def _collect(self) -> list[ClaimRecord]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        batch = []
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0 or (self._closing and batch):
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: list[ClaimRecord]):
+        attempt = 0
+        while True:
+            try:
+                async with self.engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.copy_records_to_table(
+                        'claimed_prizes', records=batch, columns=self.columns
+                    )
+                self.flushes += 1
+                self.flushed += len(batch)
+                return
+            except Exception:
+                self.failed_flushes += 1
+                attempt += 1
+                if self._closing and attempt >= 3:
+                    logger.exception("Dropping %s claims after failed flushes on shutdown", len(batch))
+                    return
+                logger.exception("Claim log flush failed, retrying")
+                await asyncio.sleep(min(2 ** attempt * 0.1, 5))
+
+
+claim_log = ClaimLog(engine, CLAIM_WRITE_BEHIND, CLAIM_LOG_BATCH_SIZE, CLAIM_LOG_FLUSH_INTERVAL, CLAIM_LOG_MAX_QUEUE)
+REGISTRY.register(StatsCollector('claim_log', claim_log.stats))
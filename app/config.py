@@ -1,5 +1,7 @@
 import os
+from decimal import Decimal
 from enum import Enum
+from urllib.parse import urlsplit
 
 #DATABASE CONFIG
 PG_USER = os.getenv("POSTGRES_USER")
@@ -7,7 +9,16 @@ PG_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 PG_HOST = os.getenv("POSTGRES_HOST")
 PG_PORT = os.getenv("POSTGRES_PORT")
 PG_DB = os.getenv("POSTGRES_DB")
-DATABASE_URL = f'postgresql+asyncpg://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}'
+DATABASE_URL = os.getenv("DATABASE_URL", f'postgresql+asyncpg://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}')
+# Необязательная реплика для читающих эндпоинтов; без неё все сессии идут в primary
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 10))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", 20))
+DB_STICKY_SECONDS = float(os.getenv("DB_STICKY_SECONDS", 5))  # чтения после своей записи идут в primary
+DB_STICKY_SIZE = 100000
+DB_WARMUP_CONNECTIONS = int(os.getenv("DB_WARMUP_CONNECTIONS", 5))  # соединений пула, открываемых до приёма трафика
 PLATFORM_URL = os.getenv("PLATFORM_URL", 'http://127.0.0.1')
 MANIFEST_URL = 'http://191.96.11.165/static/frontend/tonconnect-manifest.json'
 
@@ -16,9 +27,102 @@ SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 1
 
+#TON PROOF CONFIG
+TON_PROOF_TTL = int(os.getenv("TON_PROOF_TTL", 600))  # seconds, время жизни nonce из /auth/payload
+TON_PROOF_CLOCK_SKEW = 60  # seconds, насколько timestamp подписи может опережать часы сервера
+# Домены, для которых кошелёк может подписать proof; по умолчанию PLATFORM_URL и его хост
+TON_PROOF_DOMAINS = tuple(
+    domain.strip() for domain in os.getenv(
+        "TON_PROOF_DOMAINS", f'{PLATFORM_URL},{urlsplit(PLATFORM_URL).netloc}'
+    ).split(',') if domain.strip()
+)
+TON_PROOF_WORKERS = int(os.getenv("TON_PROOF_WORKERS", 4))  # потоков для ed25519 и хэшей
+TON_PROOF_MAX_PENDING = int(os.getenv("TON_PROOF_MAX_PENDING", 256))  # проверок в пуле и очереди к нему
+TON_PROOF_QUEUE_WAIT = float(os.getenv("TON_PROOF_QUEUE_WAIT", 1))  # seconds, дольше — 503
+# Использованные nonce; размер должен покрывать число логинов за TON_PROOF_TTL, иначе вытесненный nonce можно повторить
+TON_PROOF_REPLAY_SIZE = int(os.getenv("TON_PROOF_REPLAY_SIZE", 200000))
+
+ADMIN_ADDRESS = os.getenv("ADMIN_ADDRESS", '0x6297d5267f39c99991e70465e7cbf6f6f5f8f6f4')
+
 STATIC_PATH = '../static'
 CHUNK_SIZE = 5 * 1024 * 1024  # 5 MB
 
+#LOOTBOX IMAGES CONFIG
+IMAGE_PATH = f'{STATIC_PATH}/lootboxes'
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 10 * 1024 * 1024))  # 10 MB
+IMAGE_MAX_SIDE = 4096
+IMAGE_WIDTHS = (128, 256, 512)
+IMAGE_FORMATS = ('webp', 'png')
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+OPEN_BATCH_MAX = int(os.getenv("OPEN_BATCH_MAX", 100))
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", 10))  # seconds
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))  # seconds
+CLAIMED_PRIZES_PAGE_SIZE = 50
+CLAIMED_PRIZES_PAGE_MAX = 200
+DROP_CHANCE_TOLERANCE = Decimal('0.000001')
+MONEY_DECIMALS = 6  # суммы хранятся в BIGINT миллионных долях токена
+WEIGHT_DECIMALS = 9  # шансы выпадения хранятся целыми весами из 10^9
+CATALOG_IMPORT_CHUNK = 1000
+
+# Включать при нескольких воркерах/контейнерах: кэши согласуются через Postgres LISTEN/NOTIFY
+INVALIDATION_BUS = os.getenv("INVALIDATION_BUS", "false").lower() in ("1", "true", "yes")
+INVALIDATION_PING = 30  # seconds, проверка соединения-слушателя
+INVALIDATION_CONNECT_WAIT = 10  # seconds, сколько старт ждёт слушателя перед прогревом
+
+#LOOTBOX OPEN LIMITS CONFIG (opens per second, lootbox columns override the rates)
+OPEN_USER_RATE = float(os.getenv("OPEN_USER_RATE", 5))
+OPEN_USER_BURST = float(os.getenv("OPEN_USER_BURST", OPEN_BATCH_MAX))  # не меньше пачки, иначе она не пройдёт
+OPEN_GLOBAL_RATE = float(os.getenv("OPEN_GLOBAL_RATE", 1000))
+OPEN_GLOBAL_BURST = float(os.getenv("OPEN_GLOBAL_BURST", 2000))
+OPEN_LOCK_WAIT = float(os.getenv("OPEN_LOCK_WAIT", 1))  # seconds
+OPEN_LIMITER_BUCKETS = 100000
+# Пачку больше burst ведро не наберёт никогда, поэтому такой count отклоняется ещё при валидации
+OPEN_BATCH_LIMIT = min(OPEN_BATCH_MAX, int(OPEN_USER_BURST), int(OPEN_GLOBAL_BURST))
+
+#LIVE DROPS FEED CONFIG
+DROP_FEED_QUALITIES = ('Epic', 'Legendary')
+DROP_FEED_BUFFER = int(os.getenv("DROP_FEED_BUFFER", 50))  # последние дропы для новых подписчиков
+DROP_FEED_QUEUE = int(os.getenv("DROP_FEED_QUEUE", 100))  # недоставленных событий до отключения подписчика
+DROP_FEED_PING = 15  # seconds
+
+#NFT DELIVERY CONFIG
+NFT_BACKEND = os.getenv("NFT_BACKEND", "stub")  # имя из nft.NFT_BACKENDS или путь module:Class
+NFT_WORKERS = int(os.getenv("NFT_WORKERS", 2))
+NFT_BATCH_SIZE = int(os.getenv("NFT_BATCH_SIZE", 50))
+NFT_POLL_INTERVAL = float(os.getenv("NFT_POLL_INTERVAL", 1))  # seconds
+NFT_MAX_ATTEMPTS = int(os.getenv("NFT_MAX_ATTEMPTS", 5))
+NFT_RETRY_DELAY = float(os.getenv("NFT_RETRY_DELAY", 5))  # seconds, удваивается с каждой попыткой
+NFT_LEASE_TIMEOUT = float(os.getenv("NFT_LEASE_TIMEOUT", 300))  # seconds, после падения воркера пачка берётся заново
+NFT_STUB_LATENCY = float(os.getenv("NFT_STUB_LATENCY", 0.5))  # seconds
+NFT_STUB_FAILURE_RATE = float(os.getenv("NFT_STUB_FAILURE_RATE", 0))
+
+#DROP ANALYTICS CONFIG
+ANALYTICS_ROLLUPS = os.getenv("ANALYTICS_ROLLUPS", "true").lower() in ("1", "true", "yes")
+ANALYTICS_INTERVAL = float(os.getenv("ANALYTICS_INTERVAL", 60))  # seconds между проходами агрегатора
+ANALYTICS_LAG = int(os.getenv("ANALYTICS_LAG", 30))  # seconds, свежие строки ждут коммита параллельных транзакций
+ANALYTICS_CHUNK = 100000  # строк claimed_prizes за один шаг
+ANALYTICS_ALPHA = float(os.getenv("ANALYTICS_ALPHA", 0.001))  # уровень значимости для флага расхождения
+
+#CLAIM PARTITIONS CONFIG
+CLAIM_PARTITIONS_AHEAD = int(os.getenv("CLAIM_PARTITIONS_AHEAD", 3))  # месячных секций, создаваемых заранее
+CLAIM_RETENTION_MONTHS = int(os.getenv("CLAIM_RETENTION_MONTHS", 0))  # 0 — хранить всю историю, архивация по выбору
+CLAIM_ARCHIVE_DIR = os.getenv("CLAIM_ARCHIVE_DIR", "/archive/claimed_prizes")
+CLAIM_PARTITION_INTERVAL = float(os.getenv("CLAIM_PARTITION_INTERVAL", 3600))  # seconds между проходами обслуживания
+
+#REQUEST PROFILER CONFIG (админ включает заголовком X-Profile: 1)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))  # доля всех запросов, которые профилируются
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.001))  # seconds между снимками стека
+PROFILE_MAX_SECONDS = 30
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", 50))
+
+#WRITE-BEHIND CLAIM LOG CONFIG
+CLAIM_WRITE_BEHIND = os.getenv("CLAIM_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+CLAIM_LOG_BATCH_SIZE = int(os.getenv("CLAIM_LOG_BATCH_SIZE", 1000))
+CLAIM_LOG_FLUSH_INTERVAL = float(os.getenv("CLAIM_LOG_FLUSH_INTERVAL", 0.5))  # seconds
+CLAIM_LOG_MAX_QUEUE = int(os.getenv("CLAIM_LOG_MAX_QUEUE", 100000))
+
 
 class PrizeQualityEnum(Enum):
     common = 'Common'
@@ -30,4 +134,11 @@ class PrizeQualityEnum(Enum):
 
 class PrizeTypeEnum(Enum):
     TOKENS = 'Tokens'
-    NFT = 'NFT'
\ No newline at end of file
+    NFT = 'NFT'
+
+
+class NftDeliveryStatusEnum(Enum):
+    pending = 'pending'
+    processing = 'processing'
+    delivered = 'delivered'
+    failed = 'failed'
@@ -1,17 +1,75 @@
+import asyncio
 from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from config import DATABASE_URL
-from models import Base
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
+from config import DATABASE_URL, DATABASE_READ_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_READ_POOL_SIZE, \
+    DB_READ_MAX_OVERFLOW, DB_STICKY_SECONDS, DB_STICKY_SIZE
+from metrics import InstrumentedPool, instrument_engine
+from cache import TTLCache
 
-engine = create_async_engine(DATABASE_URL)
+engine = create_async_engine(
+    DATABASE_URL, poolclass=InstrumentedPool, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+)
+instrument_engine(engine, 'primary')
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+if DATABASE_READ_URL:
+    read_engine = create_async_engine(
+        DATABASE_READ_URL, poolclass=InstrumentedPool, pool_size=DB_READ_POOL_SIZE, max_overflow=DB_READ_MAX_OVERFLOW
+    )
+    instrument_engine(read_engine, 'replica')
+    read_session_maker = async_sessionmaker(read_engine, expire_on_commit=False)
+else:
+    read_engine = engine
+    read_session_maker = async_session_maker
 
-async def create_db_and_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+# Адреса, недавно писавшие в primary: пока реплика догоняет, их чтения идут туда же
+recent_writers: TTLCache[str, bool] = TTLCache(DB_STICKY_SIZE, DB_STICKY_SECONDS)
+
+
+def stick_to_primary(address: str):
+    if read_engine is not engine:
+        recent_writers.set(address, True)
+
+
+def session_maker_for(address: str | None) -> async_sessionmaker[AsyncSession]:
+    if address is not None and recent_writers.get(address):
+        return async_session_maker
+    return read_session_maker
+
+
+async def warm_pool(engine: AsyncEngine, connections: int) -> int:
+    """
+    Открывает до connections соединений одновременно и возвращает их в пул,
+    чтобы первые запросы после старта не платили за подключение к базе.
+
+    :return число открытых соединений
+    """
+    connections = min(connections, engine.pool.size())
+    if connections <= 0:
+        return 0
+    results = await asyncio.gather(*[engine.connect().start() for _ in range(connections)], return_exceptions=True)
+    opened = [conn for conn in results if not isinstance(conn, BaseException)]
+    try:
+        for conn in opened:
+            await conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            await conn.close()
+    for error in results:
+        if isinstance(error, BaseException):
+            raise error
+    return connections
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
+
+
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Сессия только для чтения; может отставать от primary на задержку репликации.
+    """
+    async with read_session_maker() as session:
+        yield session
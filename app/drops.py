@@ -0,0 +1,114 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Sequence
+from prometheus_client import REGISTRY
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import DROP_FEED_QUALITIES, DROP_FEED_BUFFER, DROP_FEED_QUEUE
+from invalidation import bus
+from metrics import StatsCollector
+from models import User
+from schemas import DropSchema, PrizeReadSchema
+
+DROPS_CHANNEL = 'drop_events'
+NOTIFY_CHUNK = 20  # payload NOTIFY ограничен 8000 байт
+
+
+class DropFeed:
+    """
+    Лента заметных дропов: кольцевой буфер последних событий и рассылка подписчикам.
+
+    Событие сериализуется один раз, подписчики получают готовую JSON-строку.
+    Новый подписчик сразу получает содержимое буфера. Подписчик, чья очередь
+    переполнилась, отключается, а не копит события без ограничения.
+    """
+
+    def __init__(self, buffer_size: int, queue_size: int):
+        self.recent: deque[str] = deque(maxlen=buffer_size)
+        self.queue_size = buffer_size + queue_size
+        self.subscribers: set[asyncio.Queue[str | None]] = set()
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def stats(self) -> dict:
+        return {
+            'subscribers': len(self.subscribers),
+            'buffered': len(self.recent),
+            'published': self.published,
+            'dropped_subscribers': self.dropped_subscribers,
+        }
+
+    def subscribe(self) -> asyncio.Queue[str | None]:
+        queue = asyncio.Queue(self.queue_size)
+        for message in self.recent:
+            queue.put_nowait(message)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue[str | None]):
+        self.subscribers.discard(queue)
+
+    def publish(self, messages: Sequence[str]):
+        for message in messages:
+            self.recent.append(message)
+            self.published += 1
+            for queue in list(self.subscribers):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    self._drop(queue)
+
+    def _drop(self, queue: asyncio.Queue[str | None]):
+        self.subscribers.discard(queue)
+        self.dropped_subscribers += 1
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def listen(self, ping: float) -> AsyncIterator[str | None]:
+        """
+        События для одного подписчика; None означает, что ping секунд ничего не было и пора слать keep-alive.
+        Заканчивается, когда подписчика отключили за медленное чтение.
+        """
+        queue = self.subscribe()
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), ping)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(queue)
+
+
+def notable_drops(user: User, prizes: Sequence[PrizeReadSchema]) -> list[str]:
+    claim_date = datetime.now()
+    return [
+        DropSchema(
+            lootbox_id=prize.lootbox_id,
+            prize_id=prize.id,
+            prize_name=prize.name,
+            quality=prize.quality,
+            tokens_amount=prize.tokens_amount,
+            address=user.address,
+            claim_date=claim_date
+        ).model_dump_json()
+        for prize in prizes if prize.quality.value in DROP_FEED_QUALITIES
+    ]
+
+
+async def publish_drops(s: AsyncSession, drops: list[str]):
+    """
+    Рассылает дропы другим воркерам через шину; уходит вместе с коммитом открытия.
+    """
+    for i in range(0, len(drops), NOTIFY_CHUNK):
+        await bus.publish(s, DROPS_CHANNEL, {'drops': drops[i:i + NOTIFY_CHUNK]})
+
+
+drop_feed = DropFeed(DROP_FEED_BUFFER, DROP_FEED_QUEUE)
+bus.subscribe(DROPS_CHANNEL, lambda event: drop_feed.publish(event['drops']))
+REGISTRY.register(StatsCollector('drop_feed', drop_feed.stats))
@@ -2,7 +2,8 @@ import asyncio
 from decimal import Decimal
 from config import PrizeQualityEnum, PrizeTypeEnum
 from db import async_session_maker
-from models import Prize, Lootbox
+from schemas import CatalogSchema
+from service import import_catalog
 
 
 lootboxes_data = [
@@ -31,27 +32,10 @@ lootboxes_data = [
 
 
 async def fill_db():
+    catalog = CatalogSchema.model_validate({'lootboxes': lootboxes_data})
     async with async_session_maker() as session:
-        ...
-        for lootbox_data in lootboxes_data:
-            lootbox = Lootbox(
-                name=lootbox_data["name"],
-                open_price=lootbox_data["open_price"]
-            )
-            session.add(lootbox)
+        print((await import_catalog(session, catalog)).model_dump_json(indent=2))
 
-            for prize_data in lootbox_data["prizes"]:
-                prize = Prize(
-                    name=prize_data["name"],
-                    quality=prize_data["quality"].value,
-                    drop_chance=prize_data["drop_chance"],
-                    type=prize_data["type"].value,
-                    lootbox=lootbox,
-                    tokens_amount=prize_data["tokens_amount"]
-                )
-                session.add(prize)
 
-        await session.commit()
-
-
-asyncio.run(fill_db())
\ No newline at end of file
+if __name__ == '__main__':
+    asyncio.run(fill_db())
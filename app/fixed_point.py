@@ -0,0 +1,62 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+from sqlalchemy import BigInteger, literal
+from sqlalchemy.types import TypeDecorator
+from config import MONEY_DECIMALS, WEIGHT_DECIMALS
+
+MONEY_SCALE = 10 ** MONEY_DECIMALS
+WEIGHT_SCALE = 10 ** WEIGHT_DECIMALS
+
+
+def to_fixed(value: Decimal | int | float, decimals: int) -> int:
+    value = Decimal(str(value)) if isinstance(value, float) else Decimal(value)
+    return int(value.scaleb(decimals).to_integral_value(ROUND_HALF_EVEN))
+
+
+def from_fixed(value: int, decimals: int) -> Decimal:
+    # Ноль с 9 знаками str() печатает как 0E-9
+    return Decimal(int(value)).scaleb(-decimals) if value else Decimal(0)
+
+
+def to_minor(amount: Decimal | int | float) -> int:
+    return to_fixed(amount, MONEY_DECIMALS)
+
+
+def from_minor(amount: int) -> Decimal:
+    return from_fixed(amount, MONEY_DECIMALS)
+
+
+def to_weight(chance: Decimal | int | float) -> int:
+    return to_fixed(chance, WEIGHT_DECIMALS)
+
+
+def minor(amount: int):
+    """
+    Сумма в минимальных единицах как SQL-литерал BIGINT, без пересчёта через Decimal.
+    """
+    return literal(amount, BigInteger)
+
+
+class FixedPoint(TypeDecorator):
+    """
+    BIGINT с фиксированным числом знаков после запятой; в Python значения остаются Decimal.
+    """
+
+    impl = BigInteger
+    cache_ok = True
+    decimals = 0
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_fixed(value, self.decimals)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else from_fixed(value, self.decimals)
+
+
+class Money(FixedPoint):
+    cache_ok = True
+    decimals = MONEY_DECIMALS
+
+
+class Weight(FixedPoint):
+    cache_ok = True
+    decimals = WEIGHT_DECIMALS
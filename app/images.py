@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from config import IMAGE_PATH, IMAGE_WIDTHS, IMAGE_FORMATS, IMAGE_MAX_SIDE, IMAGE_WORKERS
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+_pool: ProcessPoolExecutor | None = None
+
+
+class ImageValidationError(ValueError):
+    ...
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, а не fork: форк процесса с циклом событий и потоками копирует и их захваченные блокировки
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def write_atomic(path: str, data: bytes):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_variants(data: bytes, name_prefix: str) -> list[dict]:
+    """
+    Выполняется в дочернем процессе: проверяет PNG и пишет уменьшенные копии
+    в IMAGE_PATH под именами с хэшем содержимого.
+
+    :return список вариантов {width, format, filename}, от меньшего к большему
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise ImageValidationError("Image should have PNG type")
+
+    try:
+        image = Image.open(io.BytesIO(data), formats=['PNG'])
+        width, height = image.size
+        if width > IMAGE_MAX_SIDE or height > IMAGE_MAX_SIDE:
+            raise ImageValidationError(f"Image should be at most {IMAGE_MAX_SIDE}x{IMAGE_MAX_SIDE}")
+        image.load()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ImageValidationError(f"Invalid PNG image: {e}")
+    image = image.convert('RGBA')
+
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    os.makedirs(IMAGE_PATH, exist_ok=True)
+
+    variants = []
+    widths = sorted({w for w in IMAGE_WIDTHS if w < width} | {min(width, max(IMAGE_WIDTHS))})
+    for variant_width in widths:
+        variant_height = max(1, round(height * variant_width / width))
+        resized = image if variant_width == width else image.resize((variant_width, variant_height), Image.LANCZOS)
+        for image_format in IMAGE_FORMATS:
+            buffer = io.BytesIO()
+            if image_format == 'webp':
+                resized.save(buffer, format='WEBP', quality=80, method=4)
+            else:
+                resized.save(buffer, format='PNG', optimize=True)
+            filename = f'{name_prefix}-{digest}-{variant_width}.{image_format}'
+            write_atomic(os.path.join(IMAGE_PATH, filename), buffer.getvalue())
+            variants.append({'width': variant_width, 'format': image_format, 'filename': filename})
+    return variants
+
+
+async def process_image(data: bytes, name_prefix: str) -> list[dict]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_image_pool(), render_variants, data, name_prefix)
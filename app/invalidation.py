@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Callable
+import asyncpg
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
+from config import INVALIDATION_BUS, INVALIDATION_PING, INVALIDATION_CONNECT_WAIT
+from db import engine
+from catalog import invalidate_catalog
+from sampler import invalidate_sampler
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHANNEL = 'catalog_events'
+USERS_CHANNEL = 'user_events'
+
+
+class InvalidationBus:
+    """
+    Согласование локальных кэшей между воркерами через Postgres LISTEN/NOTIFY.
+
+    Событие публикуется в транзакции изменения и доставляется после её коммита.
+    Каждый воркер держит одно выделенное соединение-слушатель и раз в ping секунд проверяет его запросом:
+    молча оборванное TCP-соединение иначе не заметить. После потери переподключается и вызывает
+    resync-обработчики, так как события за время разрыва потеряны. Первое подключение при старте
+    кэши не сбрасывает: прогрев идёт уже после него.
+    """
+
+    def __init__(self, engine: AsyncEngine, enabled: bool, ping: float):
+        self.engine = engine
+        self.enabled = enabled
+        self.ping = ping
+        self.listening = asyncio.Event()
+        self._resync_on_connect = False
+        self.origin = uuid.uuid4().hex
+        self.handlers: dict[str, list[Callable[[dict], None]]] = {}
+        self.resync_handlers: list[Callable[[], None]] = []
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def on_resync(self, handler: Callable[[], None]):
+        self.resync_handlers.append(handler)
+
+    async def publish(self, s: AsyncSession, channel: str, payload: dict):
+        if self.enabled:
+            await s.execute(select(func.pg_notify(channel, json.dumps({**payload, 'origin': self.origin}))))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def wait_listening(self, timeout: float):
+        """
+        Ждёт первого подключения слушателя. Если не дождались, события до подключения теряются,
+        и оно сбросит кэши, как после разрыва.
+        """
+        try:
+            await asyncio.wait_for(self.listening.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._resync_on_connect = True
+            logger.warning("Invalidation listener is not connected after %ss, starting anyway", timeout)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _dispatch(self, connection, pid, channel: str, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning("Malformed %s event: %r", channel, payload)
+            return
+        if event.get('origin') == self.origin:
+            return
+        for handler in self.handlers.get(channel, []):
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("Invalidation handler failed for %s", channel)
+
+    def _resync(self):
+        for handler in self.resync_handlers:
+            handler()
+
+    async def _run(self):
+        dsn = self.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        delay = 0.5
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                for channel in self.handlers:
+                    await connection.add_listener(channel, self._dispatch)
+                if self._resync_on_connect:
+                    self._resync()
+                self._resync_on_connect = True
+                self.listening.set()
+                delay = 0.5
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), self.ping)
+                    except asyncio.TimeoutError:
+                        await asyncio.wait_for(connection.fetchval("SELECT 1"), self.ping)
+                logger.warning("Invalidation listener connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Invalidation listener failed, reconnecting in %ss", delay)
+            finally:
+                self.listening.clear()
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+def invalidate_lootbox(event: dict):
+    invalidate_sampler(event.get('lootbox_id'))
+    invalidate_catalog()
+
+
+def resync_catalog():
+    invalidate_sampler()
+    invalidate_catalog()
+
+
+bus = InvalidationBus(engine, INVALIDATION_BUS, INVALIDATION_PING)
+bus.subscribe(CATALOG_CHANNEL, invalidate_lootbox)
+bus.on_resync(resync_catalog)
+
+
+async def publish_catalog_change(s: AsyncSession, lootbox_id: int | None = None):
+    await bus.publish(s, CATALOG_CHANNEL, {'lootbox_id': lootbox_id})
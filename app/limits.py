@@ -0,0 +1,112 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from starlette import status
+from cache import TTLCache
+from config import OPEN_USER_RATE, OPEN_USER_BURST, OPEN_GLOBAL_RATE, OPEN_GLOBAL_BURST, OPEN_LOCK_WAIT, \
+    OPEN_LIMITER_BUCKETS
+from metrics import OPEN_REJECTIONS
+from sampler import LootboxSampler
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait(self, n: float = 1) -> float:
+        """
+        :return 0, если n токенов есть, иначе сколько секунд ждать до их появления; токены не списываются
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            return 0
+        return (n - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def take(self, n: float = 1) -> float:
+        """
+        :return 0, если токены списаны, иначе сколько секунд ждать до их появления
+        """
+        wait = self.wait(n)
+        if not wait:
+            self.tokens -= n
+        return wait
+
+
+def too_many_requests(reason: str, retry_after: float) -> HTTPException:
+    OPEN_REJECTIONS.labels(reason).inc()
+    seconds = max(1, math.ceil(retry_after)) if math.isfinite(retry_after) else 60
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many lootbox opens, try again later",
+        headers={'Retry-After': str(seconds)}
+    )
+
+
+class OpenLimiter:
+    """
+    Ограничивает открытия лутбоксов до обращения к базе:
+    token bucket на кошелёк и на лутбокс в целом, плюс не больше одного открытия кошелька одновременно.
+    Лимиты берутся из лутбокса, по умолчанию — из конфига.
+    """
+
+    def __init__(self):
+        self.user_buckets: TTLCache[tuple[str, int], TokenBucket] = TTLCache(OPEN_LIMITER_BUCKETS, 3600)
+        self.global_buckets: dict[int, TokenBucket] = {}
+        self.locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+    def get_user_bucket(self, address: str, sampler: LootboxSampler) -> TokenBucket:
+        key = (address, sampler.lootbox_id)
+        rate = sampler.user_open_rate or OPEN_USER_RATE
+        bucket = self.user_buckets.get(key)
+        if bucket is None or bucket.rate != rate:
+            bucket = TokenBucket(rate, max(OPEN_USER_BURST, rate))
+            self.user_buckets.set(key, bucket)
+        return bucket
+
+    def get_global_bucket(self, sampler: LootboxSampler) -> TokenBucket:
+        rate = sampler.global_open_rate or OPEN_GLOBAL_RATE
+        bucket = self.global_buckets.get(sampler.lootbox_id)
+        if bucket is None or bucket.rate != rate:
+            bucket = TokenBucket(rate, max(OPEN_GLOBAL_BURST, rate))
+            self.global_buckets[sampler.lootbox_id] = bucket
+        return bucket
+
+    @asynccontextmanager
+    async def limit(self, address: str, sampler: LootboxSampler, count: int = 1):
+        user_bucket = self.get_user_bucket(address, sampler)
+        # Токены кошелька списываются только после общего ведра, чтобы отказ по общему лимиту не тратил его квоту
+        if wait := user_bucket.wait(count):
+            raise too_many_requests('user_rate', wait)
+        if wait := self.get_global_bucket(sampler).take(count):
+            raise too_many_requests('global_rate', wait)
+        user_bucket.take(count)
+
+        lock, users = self.locks.get(address, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self.locks[address] = (lock, users + 1)
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), OPEN_LOCK_WAIT)
+            except asyncio.TimeoutError:
+                raise too_many_requests('busy', OPEN_LOCK_WAIT)
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            lock, users = self.locks[address]
+            if users == 1:
+                del self.locks[address]
+            else:
+                self.locks[address] = (lock, users - 1)
+
+
+open_limiter = OpenLimiter()
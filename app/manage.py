@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import json
+import sys
+from decimal import Decimal
+
+
+async def simulate_command(args):
+    from simulation import simulate_lootbox
+
+    if args.config:
+        from schemas import SimulationDraftSchema
+        with open(args.config) as f:
+            draft = SimulationDraftSchema.model_validate(json.load(f))
+        open_price = draft.open_price
+        chances = [prize.drop_chance for prize in draft.prizes]
+        payouts = [prize.tokens_amount for prize in draft.prizes]
+    else:
+        from db import async_session_maker
+        from service import get_lootbox_by_id
+        async with async_session_maker() as s:
+            lootbox = await get_lootbox_by_id(s, args.lootbox_id)
+        if not lootbox:
+            sys.exit(f"Lootbox {args.lootbox_id} not found")
+        open_price = lootbox.open_price
+        chances = [prize.drop_chance for prize in lootbox.prizes]
+        payouts = [prize.tokens_amount for prize in lootbox.prizes]
+
+    result = simulate_lootbox(
+        float(open_price),
+        [float(chance) for chance in chances],
+        [float(payout) for payout in payouts],
+        draws=args.draws,
+        sessions=args.sessions,
+        session_opens=args.session_opens,
+        bankroll=float(args.bankroll) if args.bankroll is not None else None,
+        seed=args.seed
+    )
+    print(json.dumps(result, indent=2))
+
+
+async def import_catalog_command(args):
+    from catalog_io import parse_catalog
+    from db import async_session_maker
+    from service import import_catalog
+
+    content_type = 'text/csv' if (args.format or args.path.rsplit('.', 1)[-1]) == 'csv' else 'application/json'
+    with open(args.path, 'rb') as f:
+        catalog = parse_catalog(f.read(), content_type)
+    async with async_session_maker() as s:
+        result = await import_catalog(s, catalog)
+    print(result.model_dump_json(indent=2))
+
+
+async def export_catalog_command(args):
+    from catalog_io import dump_catalog_csv, dump_catalog_json
+    from service import iter_catalog
+
+    dump = dump_catalog_csv if args.format == 'csv' else dump_catalog_json
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        async for chunk in dump(iter_catalog()):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+async def backfill_stats_command(args):
+    from db import async_session_maker
+    from service import backfill_user_stats
+
+    async with async_session_maker() as s:
+        print(f"Recomputed stats for {await backfill_user_stats(s)} users")
+
+
+async def migrate_command(args):
+    from migrations import migrate, SCHEMA_VERSION
+    from partitions import claim_partitions
+
+    applied = await migrate()
+    for migration in applied:
+        print(f"Applied {migration.version} {migration.name}")
+    print(f"Schema is at version {SCHEMA_VERSION}")
+    created = await claim_partitions.ensure()
+    print(f"Created partitions: {', '.join(created) or '-'}")
+
+
+async def archive_claims_command(args):
+    from partitions import claim_partitions
+
+    created, archived = await claim_partitions.maintain()
+    print(f"Created partitions: {', '.join(created) or '-'}")
+    print(f"Archived partitions: {', '.join(archived) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды сервиса")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    simulate = commands.add_parser('simulate', help="Монте-Карло экономики лутбокса")
+    source = simulate.add_mutually_exclusive_group(required=True)
+    source.add_argument('--lootbox-id', type=int)
+    source.add_argument('--config', help="JSON черновика: {open_price, prizes: [{drop_chance, tokens_amount}]}")
+    simulate.add_argument('--draws', type=int, default=10_000_000)
+    simulate.add_argument('--sessions', type=int, default=10_000)
+    simulate.add_argument('--session-opens', type=int, default=100)
+    simulate.add_argument('--bankroll', type=Decimal)
+    simulate.add_argument('--seed', type=int)
+    simulate.set_defaults(handler=simulate_command)
+
+    import_catalog = commands.add_parser('import-catalog', help="Загрузить каталог лутбоксов из JSON или CSV")
+    import_catalog.add_argument('path')
+    import_catalog.add_argument('--format', choices=('json', 'csv'), help="По умолчанию по расширению файла")
+    import_catalog.set_defaults(handler=import_catalog_command)
+
+    export_catalog = commands.add_parser('export-catalog', help="Выгрузить каталог лутбоксов")
+    export_catalog.add_argument('--format', choices=('json', 'csv'), default='json')
+    export_catalog.add_argument('--output', help="Файл; по умолчанию stdout")
+    export_catalog.set_defaults(handler=export_catalog_command)
+
+    backfill_stats = commands.add_parser('backfill-stats', help="Пересчитать user_stats по истории открытий")
+    backfill_stats.set_defaults(handler=backfill_stats_command)
+
+    migrate = commands.add_parser('migrate', help="Применить недостающие миграции и создать будущие секции")
+    migrate.set_defaults(handler=migrate_command)
+
+    archive_claims = commands.add_parser(
+        'archive-claims', help="Создать будущие секции и заархивировать секции старше срока хранения"
+    )
+    archive_claims.set_defaults(handler=archive_claims_command)
+
+    args = parser.parse_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
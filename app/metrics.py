@@ -0,0 +1,158 @@
+import time
+from contextvars import ContextVar
+from typing import Callable
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ['method', 'route', 'status']
+)
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests currently being served')
+
+DB_QUERIES = Counter('db_queries_total', 'SQL statements executed', ['engine'])
+DB_QUERY_LATENCY = Histogram('db_query_duration_seconds', 'SQL statement latency', ['engine'])
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request', 'SQL statements per HTTP request', ['route'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50)
+)
+DB_TIME_PER_REQUEST = Histogram('db_time_per_request_seconds', 'Time spent in SQL per HTTP request', ['route'])
+DB_POOL_WAIT = Histogram('db_pool_wait_seconds', 'Time waiting for a pooled connection', ['engine'])
+
+LOOTBOX_OPENS = Counter('lootbox_opens_total', 'Opened lootboxes', ['lootbox_id'])
+PRIZE_PAYOUTS = Counter('prize_payout_tokens_total', 'Tokens paid out in prizes', ['lootbox_id'])
+OPEN_REJECTIONS = Counter('lootbox_open_rejections_total', 'Lootbox opens rejected by the limiter', ['reason'])
+NFT_DELIVERIES = Counter('nft_deliveries_total', 'NFT delivery attempts by outcome', ['result'])
+NFT_MINT_LATENCY = Histogram('nft_mint_batch_seconds', 'NFT backend mint batch latency')
+AUTH_VERIFICATIONS = Counter('auth_verifications_total', 'TON proof verifications', ['result'])
+AUTH_VERIFY_FAILURES = Counter('auth_verification_failures_total', 'Rejected TON proofs by reason', ['reason'])
+AUTH_VERIFY_LATENCY = Histogram(
+    'auth_verification_duration_seconds', 'TON proof verification latency, including the wait for a crypto worker',
+    ['result'], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.timeline: list[tuple[float, float, str]] | None = None  # (начало, длительность, SQL) при профилировании
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+
+class MetricsMiddleware:
+    """
+    ASGI-мидлварь: латентность по шаблону маршрута, запросы в работе и SQL на один запрос.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUESTS_IN_FLIGHT.dec()
+            request_stats.reset(token)
+            route = scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            REQUEST_LATENCY.labels(scope['method'], path, str(status_code)).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(path).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(path).observe(stats.db_seconds)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    engine_name = 'primary'
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.labels(self.engine_name).observe(time.perf_counter() - started)
+
+
+class PoolCollector:
+    """
+    Состояние пулов всех движков: одно семейство метрик с меткой engine.
+    """
+
+    def __init__(self):
+        self.pools = {}
+
+    def add(self, engine: AsyncEngine, name: str):
+        self.pools[name] = engine.sync_engine.pool
+
+    def collect(self):
+        for metric, read in (
+                ('db_pool_size', lambda pool: pool.size()),
+                ('db_pool_checked_out', lambda pool: pool.checkedout()),
+                ('db_pool_checked_in', lambda pool: pool.checkedin()),
+                ('db_pool_overflow', lambda pool: pool.overflow()),
+        ):
+            family = GaugeMetricFamily(metric, f'Connection pool {metric[8:].replace("_", " ")}', labels=['engine'])
+            for name, pool in self.pools.items():
+                family.add_metric([name], read(pool))
+            yield family
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
+
+
+class StatsCollector:
+    """
+    Отдаёт числовые поля словаря stats_fn() как gauges с общим префиксом.
+    """
+
+    def __init__(self, prefix: str, stats_fn: Callable[[], dict]):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+
+    def collect(self):
+        for key, value in self.stats_fn().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield GaugeMetricFamily(f'{self.prefix}_{key}', f'{self.prefix} {key}', value=value)
+
+
+def instrument_engine(engine: AsyncEngine, name: str):
+    sync_engine = engine.sync_engine
+    if isinstance(sync_engine.pool, InstrumentedPool):
+        sync_engine.pool.engine_name = name
+    pool_collector.add(engine, name)
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Отметка на контексте запроса, а не стеком в conn.info: упавший запрос не вызывает after_cursor_execute
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.query_started
+        DB_QUERIES.labels(name).inc()
+        DB_QUERY_LATENCY.labels(name).observe(elapsed)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+            if stats.timeline is not None:
+                stats.timeline.append((time.perf_counter() - elapsed, elapsed, statement))
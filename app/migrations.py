@@ -0,0 +1,153 @@
+import logging
+from datetime import date
+from typing import Awaitable, Callable, NamedTuple
+from sqlalchemy import select, insert, func, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from db import engine
+from fixed_point import FixedPoint
+from models import Base, ClaimedPrize, SchemaVersion
+from partitions import PARENT, is_partitioned, create_partitions, month_start, add_months
+from config import CLAIM_PARTITIONS_AHEAD
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK = 0x6d696772  # ключ advisory-блокировки: migrate из нескольких мест не применит шаг дважды
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+
+
+async def create_tables(conn: AsyncConnection):
+    await conn.run_sync(Base.metadata.create_all)
+
+
+async def add_catalog_columns_and_indexes(conn: AsyncConnection):
+    """
+    Колонки и индексы, добавленные в модели после первой версии схемы; create_all их в существующие таблицы не вносит.
+    """
+    for statement in (
+        "ALTER TABLE lootboxes ADD COLUMN IF NOT EXISTS image_variants JSON",
+        "ALTER TABLE lootboxes ADD COLUMN IF NOT EXISTS user_open_rate DOUBLE PRECISION",
+        "ALTER TABLE lootboxes ADD COLUMN IF NOT EXISTS global_open_rate DOUBLE PRECISION",
+        "CREATE UNIQUE INDEX IF NOT EXISTS lootboxes_name_key ON lootboxes (name)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS prizes_lootbox_id_name_key ON prizes (lootbox_id, name)",
+    ):
+        await conn.execute(text(statement))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            await conn.run_sync(index.create, checkfirst=True)
+
+
+async def convert_fixed_point_columns(conn: AsyncConnection):
+    """
+    Переводит денежные колонки и шансы из double precision в BIGINT с фиксированной точкой.
+    Уже переведённые колонки пропускает.
+    """
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if not isinstance(column.type, FixedPoint):
+                continue
+            data_type = await conn.scalar(
+                text(
+                    "SELECT data_type FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+                ),
+                {'table': table.name, 'column': column.name}
+            )
+            if data_type != 'double precision':
+                continue
+            await conn.execute(text(
+                f'ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BIGINT '
+                f'USING round({column.name}::numeric * {10 ** column.type.decimals})::bigint'
+            ))
+            logger.info("Converted %s.%s to fixed point", table.name, column.name)
+
+
+async def partition_claimed_prizes(conn: AsyncConnection):
+    """
+    Переводит несекционированную claimed_prizes в секционированную по месяцам:
+    старая таблица переименовывается, строки копируются в секции, счётчик id продолжается.
+    Внешний ключ nft_deliveries.claimed_prize_id удаляется вместе с первичным ключом старой таблицы.
+    """
+    if await is_partitioned(conn):
+        return
+    legacy = f'{PARENT}_legacy'
+    await conn.execute(text(f"LOCK TABLE {PARENT} IN ACCESS EXCLUSIVE MODE"))
+    await conn.execute(text(f"ALTER TABLE {PARENT} RENAME TO {legacy}"))
+    await conn.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {PARENT}_pkey CASCADE"))
+    for index in ClaimedPrize.__table__.indexes:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    await conn.run_sync(ClaimedPrize.__table__.create)
+
+    first = await conn.scalar(text(f"SELECT min(claim_date) FROM {legacy}"))
+    today = date.today()
+    await create_partitions(
+        conn, first.date() if first else today, add_months(month_start(today), CLAIM_PARTITIONS_AHEAD)
+    )
+    moved = (await conn.execute(text(
+        f"INSERT INTO {PARENT} (id, prize_id, user_id, claim_date) "
+        f"SELECT id, prize_id, user_id, claim_date FROM {legacy}"
+    ))).rowcount
+    await conn.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{PARENT}', 'id'), coalesce(max(id), 0) + 1, false) FROM {PARENT}"
+    ))
+    await conn.execute(text(f"DROP TABLE {legacy}"))
+    logger.info("Moved %s claims into monthly partitions", moved)
+
+
+# Только дописывать в конец: номер версии применённого шага хранится в schema_version.
+# Каждый шаг идемпотентен, поэтому база, созданная до появления миграций, проходит их все с первого.
+MIGRATIONS = [
+    Migration(1, 'create_tables', create_tables),
+    Migration(2, 'catalog_columns_and_indexes', add_catalog_columns_and_indexes),
+    Migration(3, 'fixed_point_money', convert_fixed_point_columns),
+    Migration(4, 'partition_claimed_prizes', partition_claimed_prizes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+async def current_version(conn: AsyncConnection) -> int | None:
+    """
+    :return последняя применённая версия, None если миграции ещё не запускались
+    """
+    if await conn.scalar(text("SELECT to_regclass(:name) IS NULL"), {'name': SchemaVersion.__tablename__}):
+        return None
+    return await conn.scalar(select(func.coalesce(func.max(SchemaVersion.version), 0)))
+
+
+async def migrate() -> list[Migration]:
+    """
+    Применяет недостающие миграции по одной, каждую в своей транзакции вместе с записью в schema_version.
+
+    :return применённые миграции
+    """
+    applied = []
+    while True:
+        async with engine.begin() as conn:
+            await conn.execute(select(func.pg_advisory_xact_lock(MIGRATION_LOCK)))
+            await conn.run_sync(SchemaVersion.__table__.create, checkfirst=True)
+            version = await current_version(conn)
+            pending = [migration for migration in MIGRATIONS if migration.version > version]
+            if not pending:
+                return applied
+            migration = pending[0]
+            logger.info("Applying migration %s %s", migration.version, migration.name)
+            await migration.apply(conn)
+            await conn.execute(insert(SchemaVersion).values(version=migration.version, name=migration.name))
+        applied.append(migration)
+
+
+async def check_schema_version():
+    """
+    Проверка при старте вместо create_all: один запрос, схема не меняется.
+    Более новая версия допустима, чтобы старые воркеры доживали rolling-деплой после migrate.
+    """
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+    if version is None or version < SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {version}, {SCHEMA_VERSION} required: run `python manage.py migrate`"
+        )
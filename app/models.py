@@ -1,8 +1,10 @@
 import uuid
 from decimal import Decimal
 from datetime import datetime
-from sqlalchemy import UUID, Text, Double, Integer, ForeignKey, DateTime, func
+from sqlalchemy import UUID, Text, Double, Integer, BigInteger, ForeignKey, DateTime, Index, JSON, UniqueConstraint, \
+    func
 from sqlalchemy.orm import DeclarativeBase, Mapped, relationship, mapped_column
+from fixed_point import Money, Weight
 
 
 class Base(DeclarativeBase):
@@ -13,23 +15,24 @@ class User(Base):
     __tablename__ = 'users'
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    address: Mapped[str] = mapped_column(Text)
+    address: Mapped[str] = mapped_column(Text, unique=True, index=True)
     name: Mapped[str | None] = mapped_column(Text, nullable=True)
-    balance: Mapped[Decimal] = mapped_column(Double, default=Decimal(0))
+    balance: Mapped[Decimal] = mapped_column(Money(), default=Decimal(0))
 
     claimed_prizes: Mapped[list['ClaimedPrize']] = relationship('ClaimedPrize', back_populates='user')
 
 
 class Prize(Base):
     __tablename__ = 'prizes'
+    __table_args__ = (UniqueConstraint('lootbox_id', 'name'),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(Text)
     quality: Mapped[str] = mapped_column(Text)
-    drop_chance: Mapped[Decimal] = mapped_column(Double)
+    drop_chance: Mapped[Decimal] = mapped_column(Weight())
     type: Mapped[str] = mapped_column(Text)
     lootbox_id: Mapped[int] = mapped_column(ForeignKey('lootboxes.id'))
-    tokens_amount: Mapped[Decimal] = mapped_column(Double, default=Decimal(0))
+    tokens_amount: Mapped[Decimal] = mapped_column(Money(), default=Decimal(0))
 
     lootbox: Mapped['Lootbox'] = relationship('Lootbox', back_populates='prizes')
 
@@ -38,20 +41,110 @@ class Lootbox(Base):
     __tablename__ = 'lootboxes'
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    name: Mapped[str] = mapped_column(Text)
+    name: Mapped[str] = mapped_column(Text, unique=True)
     image_url: Mapped[str | None] = mapped_column(Text, nullable=True)
-    open_price: Mapped[Decimal] = mapped_column(Double)
+    image_variants: Mapped[list[dict] | None] = mapped_column(JSON, nullable=True)
+    open_price: Mapped[Decimal] = mapped_column(Money())
+    user_open_rate: Mapped[float | None] = mapped_column(Double, nullable=True)
+    global_open_rate: Mapped[float | None] = mapped_column(Double, nullable=True)
 
     prizes: Mapped[list[Prize]] = relationship(Prize, back_populates='lootbox')
 
 
 class ClaimedPrize(Base):
     __tablename__ = 'claimed_prizes'
+    # Месячные секции по claim_date ведёт partitions.py; ключ секционирования обязан входить в первичный ключ
+    __table_args__ = {'postgresql_partition_by': 'RANGE (claim_date)'}
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     prize_id: Mapped[int] = mapped_column(ForeignKey('prizes.id'))
-    user_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
-    claim_date: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('users.id'))
+    claim_date: Mapped[datetime] = mapped_column(DateTime, primary_key=True, server_default=func.now())
 
     prize: Mapped['Prize'] = relationship('Prize')
     user: Mapped['User'] = relationship('User', back_populates='claimed_prizes')
+    delivery: Mapped['NftDelivery | None'] = relationship(
+        'NftDelivery',
+        primaryjoin='ClaimedPrize.id == foreign(NftDelivery.claimed_prize_id)',
+        back_populates='claimed_prize'
+    )
+
+
+class NftDelivery(Base):
+    __tablename__ = 'nft_deliveries'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Без внешнего ключа: на секционированную claimed_prizes можно ссылаться только по (id, claim_date)
+    claimed_prize_id: Mapped[int] = mapped_column(Integer, unique=True)
+    prize_id: Mapped[int] = mapped_column(ForeignKey('prizes.id'))
+    address: Mapped[str] = mapped_column(Text)
+    idempotency_key: Mapped[str] = mapped_column(Text, unique=True)
+    status: Mapped[str] = mapped_column(Text, default='pending')
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    tx_hash: Mapped[str | None] = mapped_column(Text, nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+    claimed_prize: Mapped['ClaimedPrize'] = relationship(
+        'ClaimedPrize',
+        primaryjoin='ClaimedPrize.id == foreign(NftDelivery.claimed_prize_id)',
+        back_populates='delivery'
+    )
+
+
+class UserStats(Base):
+    __tablename__ = 'user_stats'
+
+    user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey('users.id'), primary_key=True)
+    opened: Mapped[int] = mapped_column(BigInteger, default=0)
+    spent: Mapped[Decimal] = mapped_column(Money(), default=Decimal(0))
+    won: Mapped[Decimal] = mapped_column(Money(), default=Decimal(0))
+    common_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    uncommon_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    rare_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    epic_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    legendary_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    best_prize_id: Mapped[int | None] = mapped_column(ForeignKey('prizes.id'), nullable=True)
+    best_tokens_amount: Mapped[Decimal] = mapped_column(Money(), default=Decimal(0))
+
+    best_prize: Mapped['Prize | None'] = relationship('Prize')
+
+
+class DropRollup(Base):
+    __tablename__ = 'drop_rollups'
+
+    hour: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    prize_id: Mapped[int] = mapped_column(ForeignKey('prizes.id'), primary_key=True)
+    lootbox_id: Mapped[int] = mapped_column(ForeignKey('lootboxes.id'))
+    opens: Mapped[int] = mapped_column(BigInteger, default=0)
+    revenue: Mapped[Decimal] = mapped_column(Money(), default=Decimal(0))
+    payout: Mapped[Decimal] = mapped_column(Money(), default=Decimal(0))
+
+
+class AnalyticsWatermark(Base):
+    __tablename__ = 'analytics_watermarks'
+
+    name: Mapped[str] = mapped_column(Text, primary_key=True)
+    last_id: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(Text)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+Index(
+    'ix_claimed_prizes_user_history',
+    ClaimedPrize.user_id,
+    ClaimedPrize.claim_date.desc(),
+    ClaimedPrize.id.desc()
+)
+
+Index('ix_nft_deliveries_queue', NftDelivery.status, NftDelivery.next_attempt_at)
+Index('ix_drop_rollups_lootbox_hour', DropRollup.lootbox_id, DropRollup.hour)
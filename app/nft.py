@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import importlib
+import logging
+import random
+import time
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from typing import NamedTuple
+from sqlalchemy import select, update, func, bindparam, Interval
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from config import NFT_BACKEND, NFT_WORKERS, NFT_BATCH_SIZE, NFT_POLL_INTERVAL, NFT_MAX_ATTEMPTS, NFT_RETRY_DELAY, \
+    NFT_LEASE_TIMEOUT, NFT_STUB_LATENCY, NFT_STUB_FAILURE_RATE, NftDeliveryStatusEnum
+from db import async_session_maker
+from metrics import NFT_DELIVERIES, NFT_MINT_LATENCY
+from models import NftDelivery
+
+logger = logging.getLogger(__name__)
+
+
+class MintRequest(NamedTuple):
+    idempotency_key: str
+    address: str
+    prize_id: int
+
+
+class MintResult(NamedTuple):
+    tx_hash: str | None = None
+    error: str | None = None
+
+
+class NftBackend(ABC):
+    """
+    Интерфейс выдачи NFT. mint_batch минтит/переводит пачку и возвращает результат по idempotency_key.
+    Повторный вызов с тем же ключом не должен выдавать второй NFT: после сбоя воркера пачка уходит заново.
+    Ключи, которых нет в ответе, считаются неудачными и повторяются.
+    """
+
+    @abstractmethod
+    async def mint_batch(self, requests: list[MintRequest]) -> dict[str, MintResult]:
+        ...
+
+    async def close(self):
+        pass
+
+
+class StubNftBackend(NftBackend):
+    """
+    Локальная заглушка для тестов и нагрузки: задержка на пачку и доля отказов на каждый NFT.
+    """
+
+    def __init__(self, latency: float = NFT_STUB_LATENCY, failure_rate: float = NFT_STUB_FAILURE_RATE):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.minted: dict[str, str] = {}
+        self.calls = 0
+
+    async def mint_batch(self, requests: list[MintRequest]) -> dict[str, MintResult]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        results = {}
+        for request in requests:
+            key = request.idempotency_key
+            if key not in self.minted:
+                if random.random() < self.failure_rate:
+                    results[key] = MintResult(error="Stub mint failure")
+                    continue
+                self.minted[key] = hashlib.sha256(key.encode()).hexdigest()
+            results[key] = MintResult(tx_hash=self.minted[key])
+        return results
+
+
+NFT_BACKENDS: dict[str, type[NftBackend]] = {
+    'stub': StubNftBackend,
+}
+
+
+def load_backend(name: str) -> NftBackend:
+    if name in NFT_BACKENDS:
+        return NFT_BACKENDS[name]()
+    module_name, _, class_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class NftDeliveryWorker:
+    """
+    Пул воркеров, доставляющих NFT из таблицы nft_deliveries.
+
+    Каждый воркер забирает пачку через FOR UPDATE SKIP LOCKED и переводит её в processing
+    с арендой на lease_timeout: если процесс упадёт посреди минта, пачку заберут снова,
+    а idempotency_key не даст выдать NFT дважды. Неудачные попытки возвращаются в pending
+    с экспоненциальной задержкой, после max_attempts доставка помечается failed.
+    """
+
+    def __init__(
+            self,
+            session_maker: async_sessionmaker[AsyncSession],
+            backend_name: str,
+            workers: int,
+            batch_size: int,
+            poll_interval: float,
+            max_attempts: int,
+            retry_delay: float,
+            lease_timeout: float
+    ):
+        self.session_maker = session_maker
+        self.backend_name = backend_name
+        self.backend: NftBackend | None = None
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_timeout = lease_timeout
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+
+        self.batches = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.backend_errors = 0
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend_name,
+            'workers': len(self._tasks),
+            'batches': self.batches,
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'failed': self.failed,
+            'backend_errors': self.backend_errors,
+        }
+
+    def start(self):
+        self.backend = load_backend(self.backend_name)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.backend is not None:
+            await self.backend.close()
+
+    def wake(self):
+        """
+        Будит простаивающих воркеров после коммита новых доставок, не дожидаясь poll_interval.
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self._process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("NFT delivery batch failed")
+                processed = 0
+            if not processed:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _lease_batch(self, s: AsyncSession) -> list[tuple[int, int, MintRequest]]:
+        due = (
+            select(NftDelivery.id)
+            .filter(
+                NftDelivery.status.in_([NftDeliveryStatusEnum.pending.value, NftDeliveryStatusEnum.processing.value]),
+                NftDelivery.next_attempt_at <= func.now()
+            )
+            .order_by(NftDelivery.next_attempt_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        rows = (await s.execute(
+            update(NftDelivery)
+            .filter(NftDelivery.id.in_(due.scalar_subquery()))
+            .values(
+                status=NftDeliveryStatusEnum.processing.value,
+                attempts=NftDelivery.attempts + 1,
+                next_attempt_at=func.now() + timedelta(seconds=self.lease_timeout),
+                updated_at=func.now()
+            )
+            .returning(
+                NftDelivery.id, NftDelivery.attempts, NftDelivery.idempotency_key, NftDelivery.address,
+                NftDelivery.prize_id
+            )
+            .execution_options(synchronize_session=False)
+        )).all()
+        await s.commit()
+        return [(row.id, row.attempts, MintRequest(row.idempotency_key, row.address, row.prize_id)) for row in rows]
+
+    async def _process_batch(self) -> int:
+        async with self.session_maker() as s:
+            batch = await self._lease_batch(s)
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                results = await self.backend.mint_batch([request for _, _, request in batch])
+            except Exception as e:
+                logger.exception("NFT backend failed on a batch of %s", len(batch))
+                self.backend_errors += 1
+                results = {request.idempotency_key: MintResult(error=repr(e)) for _, _, request in batch}
+            NFT_MINT_LATENCY.observe(time.perf_counter() - started)
+
+            updates, outcomes = [], []
+            for delivery_id, attempts, request in batch:
+                result = results.get(request.idempotency_key) or MintResult(error="No result from backend")
+                if result.tx_hash:
+                    status, outcome = NftDeliveryStatusEnum.delivered, 'delivered'
+                elif attempts >= self.max_attempts:
+                    status, outcome = NftDeliveryStatusEnum.failed, 'failed'
+                else:
+                    status, outcome = NftDeliveryStatusEnum.pending, 'retry'
+                outcomes.append(outcome)
+                updates.append({
+                    'delivery_id': delivery_id,
+                    'new_status': status.value,
+                    'new_tx_hash': result.tx_hash,
+                    'new_error': result.error,
+                    'delay': timedelta(seconds=self.retry_delay * 2 ** (attempts - 1)),
+                })
+            await s.execute(
+                update(NftDelivery.__table__)
+                .where(NftDelivery.__table__.c.id == bindparam('delivery_id'))
+                .values(
+                    status=bindparam('new_status'),
+                    tx_hash=bindparam('new_tx_hash'),
+                    last_error=bindparam('new_error'),
+                    next_attempt_at=func.now() + bindparam('delay', type_=Interval),
+                    updated_at=func.now()
+                ),
+                updates
+            )
+            await s.commit()
+
+        self.batches += 1
+        for outcome in outcomes:
+            NFT_DELIVERIES.labels(outcome).inc()
+        self.delivered += outcomes.count('delivered')
+        self.retried += outcomes.count('retry')
+        self.failed += outcomes.count('failed')
+        return len(batch)
+
+
+nft_worker = NftDeliveryWorker(
+    async_session_maker,
+    NFT_BACKEND,
+    NFT_WORKERS,
+    NFT_BATCH_SIZE,
+    NFT_POLL_INTERVAL,
+    NFT_MAX_ATTEMPTS,
+    NFT_RETRY_DELAY,
+    NFT_LEASE_TIMEOUT
+)
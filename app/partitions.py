@@ -0,0 +1,256 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime
+from prometheus_client import REGISTRY
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
+from config import CLAIM_PARTITIONS_AHEAD, CLAIM_RETENTION_MONTHS, CLAIM_ARCHIVE_DIR, CLAIM_PARTITION_INTERVAL
+from analytics import drop_rollups, ROLLUP_WATERMARK
+from db import engine
+from metrics import StatsCollector
+from models import ClaimedPrize, AnalyticsWatermark
+
+logger = logging.getLogger(__name__)
+
+PARENT = ClaimedPrize.__tablename__
+PARTITION_NAME = re.compile(rf'^{PARENT}_p(\d{{4}})(\d{{2}})$')
+MAINTENANCE_LOCK = 0x636c61696d  # ключ advisory-блокировки, общий для всех воркеров
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'{PARENT}_p{month:%Y%m}'
+
+
+def partition_month(name: str) -> date | None:
+    match = PARTITION_NAME.match(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    relkind = await conn.scalar(
+        text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:name)"), {'name': PARENT}
+    )
+    return relkind == 'p'
+
+
+async def create_partitions(conn: AsyncConnection, first: date, last: date) -> list[str]:
+    """
+    Создаёт недостающие месячные секции с first по last включительно.
+    """
+    existing = set((await conn.execute(
+        text("SELECT relname FROM pg_class WHERE relname LIKE :prefix AND relkind = 'r'"),
+        {'prefix': f'{PARENT}_p%'}
+    )).scalars())
+    created = []
+    month = month_start(first)
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+async def unlock(conn: AsyncConnection):
+    # Соединение, прерванное отменой посреди запроса, инвалидировано и будет закрыто: блокировка уйдёт вместе с сессией,
+    # а запрос на нём заменил бы CancelledError на PendingRollbackError и stop() ждал бы следующего прохода
+    if not conn.invalidated:
+        await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MAINTENANCE_LOCK})
+
+
+class ClaimPartitionMaintainer:
+    """
+    Ведёт месячные секции claimed_prizes: заранее создаёт ahead будущих месяцев,
+    а секции старше retention месяцев отсоединяет (DETACH CONCURRENTLY), выгружает
+    в gzip-CSV в archive_dir и удаляет. Вставки и свежая история всегда попадают
+    в несколько последних секций, поэтому их стоимость не растёт с возрастом таблицы.
+
+    Проходы воркеров сериализуются advisory-блокировкой. Секция с id выше водяного знака
+    drop_rollups не архивируется, пока агрегатор её не посчитал. Прерванный проход
+    дочищается следующим: зависший DETACH завершается через FINALIZE, отсоединённые
+    секции выгружаются заново.
+    """
+
+    def __init__(
+            self,
+            engine: AsyncEngine,
+            ahead: int,
+            retention: int,
+            archive_dir: str,
+            interval: float
+    ):
+        self.engine = engine
+        self.ahead = ahead
+        self.retention = retention
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+        self.passes = 0
+        self.failed_passes = 0
+        self.created = 0
+        self.archived = 0
+        self.archived_rows = 0
+
+    def stats(self) -> dict:
+        return {
+            'retention_months': self.retention,
+            'passes': self.passes,
+            'failed_passes': self.failed_passes,
+            'created': self.created,
+            'archived': self.archived,
+            'archived_rows': self.archived_rows,
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        # Первый проход сразу при старте: секции, созданные migrate, могли закончиться, пока сервис стоял
+        while True:
+            try:
+                await self.maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed_passes += 1
+                logger.exception("Claim partition maintenance failed")
+            await asyncio.sleep(self.interval)
+
+    async def ensure(self, since: datetime | None = None) -> list[str]:
+        """
+        Создаёт секции от месяца since (по умолчанию текущего) на ahead месяцев вперёд.
+        Вызывается из manage.py migrate и ждёт блокировку, а не пропускает проход, как maintain:
+        к концу migrate секции для вставок должны уже существовать.
+        """
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            await conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': MAINTENANCE_LOCK})
+            try:
+                return await self._ensure(conn, since)
+            finally:
+                await unlock(conn)
+
+    async def maintain(self) -> tuple[list[str], list[str]]:
+        """
+        Один проход обслуживания; если его уже выполняет другой воркер, ничего не делает.
+
+        :return созданные и заархивированные секции
+        """
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            if not await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {'key': MAINTENANCE_LOCK}):
+                return [], []
+            try:
+                created = await self._ensure(conn)
+                archived = await self._archive_expired(conn)
+            finally:
+                await unlock(conn)
+        self.passes += 1
+        return created, archived
+
+    async def _ensure(self, conn: AsyncConnection, since: datetime | None = None) -> list[str]:
+        if not await is_partitioned(conn):
+            logger.warning("%s is not partitioned, run `manage.py migrate`", PARENT)
+            return []
+        first = (since or datetime.now()).date()
+        # Короткий lock_timeout: CREATE TABLE ... PARTITION OF блокирует родителя, очередь за ним ждать не должна
+        await conn.execute(text("SET lock_timeout = '5s'"))
+        try:
+            created = await create_partitions(conn, first, add_months(month_start(date.today()), self.ahead))
+        finally:
+            await conn.execute(text("RESET lock_timeout"))
+        self.created += len(created)
+        return created
+
+    async def _archive_expired(self, conn: AsyncConnection) -> list[str]:
+        if self.retention <= 0:
+            return []
+        cutoff = add_months(month_start(date.today()), -self.retention)
+        rows = await conn.execute(
+            text(
+                "SELECT c.relname, i.inhrelid IS NOT NULL, coalesce(i.inhdetachpending, false) "
+                "FROM pg_class c LEFT JOIN pg_inherits i ON i.inhrelid = c.oid "
+                "WHERE c.relname LIKE :prefix AND c.relkind = 'r' ORDER BY c.relname"
+            ),
+            {'prefix': f'{PARENT}_p%'}
+        )
+        watermark = None
+        if drop_rollups.enabled:
+            watermark = await conn.scalar(
+                select(AnalyticsWatermark.last_id).filter(AnalyticsWatermark.name == ROLLUP_WATERMARK)
+            ) or 0
+
+        archived = []
+        for name, attached, detach_pending in rows.all():
+            month = partition_month(name)
+            if month is None or add_months(month, 1) > cutoff:
+                continue
+            if watermark is not None:
+                last_id = await conn.scalar(text(f"SELECT max(id) FROM {name}"))
+                if last_id is not None and last_id > watermark:
+                    logger.info("Postponing archival of %s until drop rollups catch up", name)
+                    continue
+            if detach_pending:
+                await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name} FINALIZE"))
+            elif attached:
+                await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name} CONCURRENTLY"))
+            self.archived_rows += await self._dump(conn, name)
+            await conn.execute(text(f"DROP TABLE {name}"))
+            self.archived += 1
+            archived.append(name)
+            logger.info("Archived claim partition %s", name)
+        return archived
+
+    async def _dump(self, conn: AsyncConnection, name: str) -> int:
+        """
+        Выгружает секцию через COPY в gzip-CSV с заголовком; файл появляется под итоговым именем только целиком.
+
+        :return число выгруженных строк
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f'{name}.csv.gz')
+        partial = f'{path}.part'
+        archive = await asyncio.to_thread(gzip.open, partial, 'wb')
+        try:
+            async def write(chunk: bytes):
+                await asyncio.to_thread(archive.write, chunk)
+
+            raw = await conn.get_raw_connection()
+            status = await raw.driver_connection.copy_from_table(name, output=write, format='csv', header=True)
+        finally:
+            await asyncio.to_thread(archive.close)
+        await asyncio.to_thread(os.replace, partial, path)
+        return int(status.rsplit(' ', 1)[-1])
+
+
+claim_partitions = ClaimPartitionMaintainer(
+    engine, CLAIM_PARTITIONS_AHEAD, CLAIM_RETENTION_MONTHS, CLAIM_ARCHIVE_DIR, CLAIM_PARTITION_INTERVAL
+)
+REGISTRY.register(StatsCollector('claim_partitions', claim_partitions.stats))
@@ -0,0 +1,260 @@
+import asyncio
+import marshal
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from types import CodeType, FrameType
+from config import PROFILE_SAMPLE_RATE, PROFILE_INTERVAL, PROFILE_MAX_SECONDS, PROFILE_STORE_SIZE
+from metrics import request_stats
+from users import is_admin_token
+
+PROFILE_HEADER = b'x-profile'
+
+FrameKey = tuple[str, int, str]  # (файл, строка, функция), как в pstats
+WAITING: FrameKey = ('~', 0, '(waiting)')
+
+
+def frame_key(code: CodeType) -> FrameKey:
+    return code.co_filename, code.co_firstlineno, code.co_qualname
+
+
+class Profile:
+    def __init__(self, method: str, path: str, interval: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.interval = interval
+        self.started_at = datetime.now()
+        self.status: int | None = None
+        self.duration = 0.0
+        self.samples: list[tuple[tuple[FrameKey, ...], float]] = []  # стек от корня и wall-clock вес
+        self.sql: list[tuple[float, float, str]] = []  # (смещение от начала запроса, длительность, SQL)
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'started_at': self.started_at.isoformat(),
+            'duration': self.duration,
+            'samples': len(self.samples),
+            'queries': len(self.sql),
+            'db_seconds': sum(duration for _, duration, _ in self.sql),
+        }
+
+    def to_speedscope(self) -> dict:
+        frames: list[dict] = []
+        index: dict[FrameKey, int] = {}
+
+        def frame_id(key: FrameKey) -> int:
+            if key not in index:
+                index[key] = len(frames)
+                frames.append({'name': key[2], 'file': key[0], 'line': key[1]})
+            return index[key]
+
+        samples = [[frame_id(key) for key in stack] for stack, _ in self.samples]
+        events = []
+        last_end = 0.0
+        for offset, duration, statement in self.sql:
+            start = max(offset, last_end)
+            last_end = max(start, offset + duration)
+            sql_frame = len(frames)
+            frames.append({'name': ' '.join(statement.split())[:200]})
+            events.append({'type': 'O', 'frame': sql_frame, 'at': start})
+            events.append({'type': 'C', 'frame': sql_frame, 'at': last_end})
+
+        title = f'{self.method} {self.path}'
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': title,
+            'exporter': 'mega_money profiler',
+            'shared': {'frames': frames},
+            'profiles': [
+                {
+                    'type': 'sampled',
+                    'name': f'{title} (wall clock)',
+                    'unit': 'seconds',
+                    'startValue': 0,
+                    'endValue': self.duration,
+                    'samples': samples,
+                    'weights': [weight for _, weight in self.samples],
+                },
+                {
+                    'type': 'evented',
+                    'name': f'{title} (SQL)',
+                    'unit': 'seconds',
+                    'startValue': 0,
+                    'endValue': max(self.duration, last_end),
+                    'events': events,
+                },
+            ],
+        }
+
+    def to_pstats(self) -> bytes:
+        """
+        Дамп в формате cProfile/pstats: число вызовов здесь — число снимков, в которых была функция.
+        """
+        stats: dict[FrameKey, list] = {}
+        for stack, weight in self.samples:
+            seen = set()
+            for depth, key in enumerate(stack):
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                leaf = depth == len(stack) - 1
+                if key not in seen:
+                    seen.add(key)
+                    entry[0] += 1
+                    entry[1] += 1
+                    entry[3] += weight
+                if leaf:
+                    entry[2] += weight
+                if depth:
+                    caller = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                    caller[0] += 1
+                    caller[1] += 1
+                    caller[2] += weight if leaf else 0.0
+                    caller[3] += weight
+        return marshal.dumps({
+            key: (cc, nc, tt, ct, {caller: tuple(values) for caller, values in callers.items()})
+            for key, (cc, nc, tt, ct, callers) in stats.items()
+        })
+
+
+class StackSampler(threading.Thread):
+    """
+    Снимает стек одной asyncio-задачи с заданным интервалом из отдельного потока.
+
+    Пока задача выполняется, берётся стек потока цикла событий, включая синхронные вызовы
+    (хеши, ed25519). Пока она ждёт, берётся цепочка await её корутин и помечается (waiting):
+    так профиль показывает wall-clock время, в том числе ожидание базы.
+    """
+
+    def __init__(self, profile: Profile, task: asyncio.Task, root: FrameType, max_seconds: float):
+        super().__init__(name=f'profiler-{profile.id}', daemon=True)
+        self.profile = profile
+        self.task = task
+        self.loop = task.get_loop()
+        self.root = root
+        self.max_seconds = max_seconds
+        self.thread_id = threading.get_ident()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        started = last = time.perf_counter()
+        while not self._stop_event.wait(self.profile.interval):
+            now = time.perf_counter()
+            if now - started > self.max_seconds:
+                return
+            stack = self.sample()
+            if self._stop_event.is_set():
+                return
+            if stack:
+                self.profile.samples.append((stack, now - last))
+            last = now
+
+    def sample(self) -> tuple[FrameKey, ...]:
+        if asyncio.current_task(self.loop) is self.task:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_key(frame.f_code))
+                if frame is self.root:
+                    break
+                frame = frame.f_back
+            stack.reverse()
+            return tuple(stack)
+
+        stack = []
+        awaitable = self.task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'ag_frame', None) \
+                or getattr(awaitable, 'gi_frame', None)
+            if frame is None:
+                break
+            if frame is self.root or stack:
+                stack.append(frame_key(frame.f_code))
+            awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'ag_await', None) \
+                or getattr(awaitable, 'gi_yieldfrom', None)
+        if stack:
+            stack.append(WAITING)
+        return tuple(stack)
+
+
+class ProfileStore:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._profiles: OrderedDict[str, Profile] = OrderedDict()
+
+    def add(self, profile: Profile):
+        self._profiles[profile.id] = profile
+        while len(self._profiles) > self.maxsize:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Profile | None:
+        return self._profiles.get(profile_id)
+
+    def list(self) -> list[dict]:
+        return [profile.summary() for profile in reversed(self._profiles.values())]
+
+
+profile_store = ProfileStore(PROFILE_STORE_SIZE)
+
+
+def profiling_requested(scope) -> bool:
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    headers = dict(scope['headers'])
+    if headers.get(PROFILE_HEADER) not in (b'1', b'true'):
+        return False
+    scheme, _, token = headers.get(b'authorization', b'').decode('latin-1').partition(' ')
+    return scheme.lower() == 'bearer' and is_admin_token(token)
+
+
+class ProfilerMiddleware:
+    """
+    ASGI-мидлварь выборочного профилирования: запрос админа с заголовком X-Profile: 1
+    или доля PROFILE_SAMPLE_RATE всех запросов. Остальные запросы проходят без накладных расходов,
+    кроме проверки заголовка. Id профиля возвращается в заголовке X-Profile-Id.
+    Должна стоять внутри MetricsMiddleware: SQL-таймлайн берётся из её request_stats.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not profiling_requested(scope):
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope['method'], scope['path'], PROFILE_INTERVAL)
+
+        async def send_with_profile_id(message):
+            if message['type'] == 'http.response.start':
+                profile.status = message['status']
+                message = {**message, 'headers': [*message.get('headers', []), (b'x-profile-id', profile.id.encode())]}
+            await send(message)
+
+        stats = request_stats.get()
+        if stats is not None:
+            stats.timeline = []
+        sampler = StackSampler(profile, asyncio.current_task(), sys._getframe(), PROFILE_MAX_SECONDS)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.duration = time.perf_counter() - started
+            sampler.stop()
+            if stats is not None:
+                profile.sql = [(at - started, duration, statement) for at, duration, statement in stats.timeline]
+                stats.timeline = None
+            route = scope.get('route')
+            profile.path = getattr(route, 'path', profile.path)
+            profile_store.add(profile)
@@ -0,0 +1,105 @@
+import random
+from typing import Sequence
+from schemas import PrizeReadSchema
+
+
+class AliasTable:
+    """
+    Таблица Уокера/Воуза на целых весах: построение за O(n), выборка за O(1).
+    Вероятности хранятся как доли суммы весов, поэтому распределение воспроизводится точно.
+    """
+
+    def __init__(self, weights: Sequence[int]):
+        n = len(weights)
+        if n == 0:
+            raise ValueError("Alias table needs at least one weight")
+        total = sum(weights)
+        if total <= 0:
+            raise ValueError("Alias table needs a positive total weight")
+
+        self.size = n
+        self.total = total
+        self.prob = [total] * n
+        self.alias = list(range(n))
+
+        scaled = [w * n for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < total]
+        large = [i for i, p in enumerate(scaled) if p >= total]
+
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - total
+            (small if scaled[l] < total else large).append(l)
+
+    def sample(self, rng: random.Random = random) -> int:
+        i = rng.randrange(self.size)
+        return i if rng.randrange(self.total) < self.prob[i] else self.alias[i]
+
+    def sample_many(self, k: int, rng: random.Random = random) -> list[int]:
+        n, total, prob, alias = self.size, self.total, self.prob, self.alias
+        randrange = rng.randrange
+        draws = [randrange(n) for _ in range(k)]
+        return [i if randrange(total) < prob[i] else alias[i] for i in draws]
+
+
+class LootboxSampler:
+    """
+    Всё, что нужно для открытия лутбокса без запросов к каталогу.
+    Цена и выплаты хранятся в минимальных единицах (fixed_point), чтобы открытие считалось в целых числах.
+    """
+
+    def __init__(
+            self,
+            lootbox_id: int,
+            open_price: int,
+            prizes: Sequence[PrizeReadSchema],
+            payouts: Sequence[int],
+            weights: Sequence[int],
+            user_open_rate: float | None = None,
+            global_open_rate: float | None = None
+    ):
+        self.lootbox_id = lootbox_id
+        self.open_price = open_price
+        self.user_open_rate = user_open_rate
+        self.global_open_rate = global_open_rate
+        self.prizes = list(prizes)
+        self.prize_ids = [prize.id for prize in self.prizes]
+        self.payouts = list(payouts)
+        self.table = AliasTable(weights) if self.prizes else None
+
+    def draw(self) -> int:
+        return self.table.sample()
+
+    def draw_many(self, k: int) -> list[int]:
+        return self.table.sample_many(k)
+
+
+_samplers: dict[int, LootboxSampler] = {}
+_generation = 0
+
+
+def get_cached_sampler(lootbox_id: int) -> LootboxSampler | None:
+    return _samplers.get(lootbox_id)
+
+
+def sampler_generation() -> int:
+    return _generation
+
+
+def cache_sampler(sampler: LootboxSampler, generation: int):
+    """
+    Сохраняет таблицу, только если сэмплеры не инвалидировали, пока лутбокс читался из базы.
+    """
+    if generation == _generation:
+        _samplers[sampler.lootbox_id] = sampler
+
+
+def invalidate_sampler(lootbox_id: int | None = None):
+    global _generation
+    _generation += 1
+    if lootbox_id is None:
+        _samplers.clear()
+    else:
+        _samplers.pop(lootbox_id, None)
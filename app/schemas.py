@@ -2,8 +2,9 @@ import uuid
 from datetime import datetime
 from decimal import Decimal
 from typing import Literal
-from pydantic import BaseModel, Field
-from config import PrizeQualityEnum, PrizeTypeEnum, PLATFORM_URL
+from pydantic import BaseModel, Field, model_validator
+from config import PrizeQualityEnum, PrizeTypeEnum, NftDeliveryStatusEnum, PLATFORM_URL, OPEN_BATCH_LIMIT, \
+    DROP_CHANCE_TOLERANCE
 
 
 class TonPayload(BaseModel):
@@ -51,25 +52,58 @@ class PrizeReadSchema(BaseModel):
     tokens_amount: Decimal
 
 
+class UserStatsReadSchema(BaseModel):
+    opened: int = 0
+    spent: Decimal = Decimal(0)
+    won: Decimal = Decimal(0)
+    opened_by_quality: dict[PrizeQualityEnum, int] = {}
+    best_prize: PrizeReadSchema | None = None
+
+
 class PrizeCreateSchema(BaseModel):
     name: str
     lootbox_id: int
     quality: PrizeQualityEnum
-    drop_chance: Decimal
+    drop_chance: Decimal = Field(gt=0, le=1)
     type: PrizeTypeEnum
     tokens_amount: Decimal
 
 
+class NftDeliveryReadSchema(BaseModel):
+    status: NftDeliveryStatusEnum
+    attempts: int
+    tx_hash: str | None
+    updated_at: datetime
+
+
 class ClaimedPrizeReadSchema(BaseModel):
     id: int
     claim_date: datetime
     prize: PrizeReadSchema
+    delivery: NftDeliveryReadSchema | None = None
+
+
+class DropSchema(BaseModel):
+    lootbox_id: int
+    prize_id: int
+    prize_name: str
+    quality: PrizeQualityEnum
+    tokens_amount: Decimal
+    address: str
+    claim_date: datetime
+
+
+class LootboxImageVariantSchema(BaseModel):
+    width: int
+    format: Literal['webp', 'png']
+    url: str
 
 
 class LootboxReadSchema(BaseModel):
     id: int
     name: str
     image_url: str | None
+    image_variants: list[LootboxImageVariantSchema] | None = None
     open_price: Decimal
     prizes: list[PrizeReadSchema]
 
@@ -77,7 +111,141 @@ class LootboxReadSchema(BaseModel):
 class LootboxCreateSchema(BaseModel):
     name: str
     open_price: Decimal
+    user_open_rate: float | None = Field(None, gt=0)
+    global_open_rate: float | None = Field(None, gt=0)
 
 
 class LootboxOpenSchema(BaseModel):
     id: int
+
+
+class LootboxOpenBatchSchema(BaseModel):
+    id: int
+    count: int = Field(gt=0, le=OPEN_BATCH_LIMIT)
+
+
+class SimulationPrizeSchema(BaseModel):
+    drop_chance: Decimal = Field(ge=0)
+    tokens_amount: Decimal = Field(ge=0)
+
+
+class SimulationParamsSchema(BaseModel):
+    draws: int = Field(10_000_000, ge=0, le=100_000_000)
+    sessions: int = Field(10_000, ge=0, le=1_000_000)
+    session_opens: int = Field(100, gt=0, le=10_000)
+    bankroll: Decimal | None = None
+    seed: int | None = None
+
+
+class SimulationDraftSchema(SimulationParamsSchema):
+    open_price: Decimal = Field(gt=0)
+    prizes: list[SimulationPrizeSchema] = Field(min_length=1)
+
+
+class SimulationCurvePointSchema(BaseModel):
+    opens: int
+    net: dict[str, float]
+
+
+class SimulationResultSchema(BaseModel):
+    open_price: float
+    draws: int
+    sessions: int
+    session_opens: int
+    bankroll: float
+    expected_payout: float
+    house_edge: float | None
+    payout_variance: float
+    payout_std: float
+    observed_mean_payout: float | None
+    observed_payout_variance: float | None
+    observed_drop_rates: list[float]
+    configured_drop_rates: list[float]
+    ruin_probability: float | None
+    session_net_percentiles: dict[str, float]
+    percentile_curves: list[SimulationCurvePointSchema]
+    seconds: float
+
+
+class CatalogPrizeSchema(BaseModel):
+    name: str
+    quality: PrizeQualityEnum
+    drop_chance: Decimal = Field(gt=0, le=1)
+    type: PrizeTypeEnum
+    tokens_amount: Decimal = Field(Decimal(0), ge=0)
+
+
+class CatalogLootboxSchema(BaseModel):
+    name: str
+    open_price: Decimal = Field(gt=0)
+    user_open_rate: float | None = Field(None, gt=0)
+    global_open_rate: float | None = Field(None, gt=0)
+    prizes: list[CatalogPrizeSchema] = []
+
+    @model_validator(mode='after')
+    def check_prizes(self):
+        names = [prize.name for prize in self.prizes]
+        if len(names) != len(set(names)):
+            raise ValueError(f"Lootbox '{self.name}' has duplicate prize names")
+        total = sum(prize.drop_chance for prize in self.prizes)
+        if self.prizes and abs(total - 1) > DROP_CHANCE_TOLERANCE:
+            raise ValueError(f"Drop chances of lootbox '{self.name}' should sum up to 1, got {total}")
+        return self
+
+
+class CatalogSchema(BaseModel):
+    lootboxes: list[CatalogLootboxSchema]
+
+    @model_validator(mode='after')
+    def check_lootboxes(self):
+        names = [lootbox.name for lootbox in self.lootboxes]
+        if len(names) != len(set(names)):
+            raise ValueError("Catalog has duplicate lootbox names")
+        return self
+
+
+class CatalogImportResultSchema(BaseModel):
+    lootboxes_created: int = 0
+    lootboxes_updated: int = 0
+    lootboxes_unchanged: int = 0
+    prizes_created: int = 0
+    prizes_updated: int = 0
+    prizes_unchanged: int = 0
+    prizes_removed: int = 0
+
+
+class PrizeDropRateSchema(BaseModel):
+    prize_id: int
+    name: str
+    quality: PrizeQualityEnum
+    configured_rate: float
+    observed: int
+    observed_rate: float
+    expected: float
+    confidence_low: float
+    confidence_high: float
+    flagged: bool
+
+
+class LootboxDropRateSchema(BaseModel):
+    lootbox_id: int
+    name: str
+    opens: int
+    chi_square: float | None
+    degrees_of_freedom: int
+    p_value: float | None
+    flagged: bool
+    prizes: list[PrizeDropRateSchema]
+
+
+class LootboxTimeseriesPointSchema(BaseModel):
+    bucket: datetime
+    opens: int
+    revenue: Decimal
+    payout: Decimal
+    rtp: float | None
+
+
+class LootboxTimeseriesSchema(BaseModel):
+    lootbox_id: int
+    points: list[LootboxTimeseriesPointSchema]
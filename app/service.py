@@ -1,19 +1,42 @@
-import random
+import base64
+import logging
+import uuid
+from datetime import datetime
 from decimal import Decimal
-from typing import Sequence
+from statistics import NormalDist
+from typing import Sequence, AsyncIterator, Literal
 from fastapi import HTTPException, UploadFile
-from sqlalchemy import select
+from sqlalchemy import select, update, insert, tuple_, or_, and_, any_, literal, literal_column, case, func, Text, \
+    Integer, ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy.orm import selectinload, joinedload, contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
 from starlette import status
-from config import CHUNK_SIZE, STATIC_PATH, PLATFORM_URL, PrizeTypeEnum
-from schemas import LootboxOpenSchema, PrizeCreateSchema, LootboxCreateSchema
-from models import User, Lootbox, Prize, ClaimedPrize
-import aiofiles
+from starlette.concurrency import run_in_threadpool
+from config import CHUNK_SIZE, PLATFORM_URL, IMAGE_MAX_BYTES, CATALOG_IMPORT_CHUNK, ANALYTICS_ALPHA, PrizeTypeEnum, \
+    PrizeQualityEnum, NftDeliveryStatusEnum
+from schemas import LootboxOpenSchema, LootboxOpenBatchSchema, PrizeCreateSchema, LootboxCreateSchema, PrizeReadSchema, \
+    SimulationParamsSchema, SimulationDraftSchema, CatalogSchema, CatalogImportResultSchema, UserStatsReadSchema, \
+    PrizeDropRateSchema, LootboxDropRateSchema, LootboxTimeseriesPointSchema, LootboxTimeseriesSchema
+from models import User, Lootbox, Prize, ClaimedPrize, UserStats, NftDelivery, DropRollup
+from db import async_session_maker, stick_to_primary
+from sampler import LootboxSampler, get_cached_sampler, sampler_generation, cache_sampler, invalidate_sampler
+from claim_log import ClaimRecord, claim_log
+from metrics import LOOTBOX_OPENS, PRIZE_PAYOUTS
+from catalog import CatalogSnapshot, build_catalog, get_cached_catalog, catalog_generation, cache_catalog, \
+    invalidate_catalog
+from images import ImageValidationError, process_image
+from limits import open_limiter
+from invalidation import bus, publish_catalog_change, USERS_CHANNEL
+from simulation import simulate_lootbox
+from fixed_point import MONEY_SCALE, to_minor, to_weight, from_minor, minor
+from drops import drop_feed, notable_drops, publish_drops
+from nft import nft_worker
+from analytics import wilson_interval, chi_square_p_value
 
-
-def get_file_path(lootbox_id: int):
-    return f"{STATIC_PATH}/{lootbox_id}.png"
+logger = logging.getLogger(__name__)
 
 
 async def get_user_by_address(s: AsyncSession, address: str) -> User | None:
@@ -25,10 +48,14 @@ async def get_user_by_address(s: AsyncSession, address: str) -> User | None:
 async def get_or_create_user(s: AsyncSession, address: str) -> User:
     user = await get_user_by_address(s, address)
     if not user:
-        user = User(address=address, name=None, balance=Decimal(10000))
-        s.add(user)
+        await s.execute(
+            pg_insert(User)
+            .values(id=uuid.uuid4(), address=address, name=None, balance=Decimal(10000))
+            .on_conflict_do_nothing(index_elements=[User.address])
+        )
         await s.commit()
-        await s.refresh(user)
+        user = await get_user_by_address(s, address)
+    stick_to_primary(address)
     return user
 
 
@@ -49,8 +76,19 @@ async def create_prize(s: AsyncSession, schema: PrizeCreateSchema) -> Prize:
         type=schema.type.value
     )
     s.add(prize)
+    try:
+        await s.flush()
+    except IntegrityError:
+        await s.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Prize with this name already exists")
+    await publish_catalog_change(s, lootbox.id)
     await s.commit()
     await s.refresh(prize)
+    invalidate_sampler(lootbox.id)
+    # lootbox.prizes загружен до вставки и без expire_on_commit не обновится сам
+    s.expire(lootbox, ['prizes'])
+    await load_lootbox_sampler(s, lootbox.id)
+    invalidate_catalog()
     return prize
 
 
@@ -59,6 +97,15 @@ async def get_all_lootboxes(s: AsyncSession) -> Sequence[Lootbox]:
     return lootboxes.scalars().all()
 
 
+async def get_lootbox_catalog(s: AsyncSession) -> CatalogSnapshot:
+    catalog = get_cached_catalog()
+    if catalog is None:
+        generation = catalog_generation()
+        catalog = build_catalog(await get_all_lootboxes(s))
+        cache_catalog(catalog, generation)
+    return catalog
+
+
 async def get_lootbox_by_id(s: AsyncSession, lootbox_id: int) -> Lootbox | None:
     lootbox = await s.execute(
         select(Lootbox).filter(Lootbox.id == lootbox_id).options(selectinload(Lootbox.prizes)).limit(1)
@@ -66,11 +113,73 @@ async def get_lootbox_by_id(s: AsyncSession, lootbox_id: int) -> Lootbox | None:
     return lootbox.scalar()
 
 
+def build_lootbox_sampler(lootbox: Lootbox) -> LootboxSampler:
+    # Призы с нулевым шансом сняты с розыгрыша импортом, но остаются в базе ради истории открытий
+    active = [prize for prize in lootbox.prizes if prize.drop_chance > 0]
+    prizes = [PrizeReadSchema.model_validate(prize, from_attributes=True) for prize in active]
+    return LootboxSampler(
+        lootbox.id,
+        to_minor(lootbox.open_price),
+        prizes,
+        [to_minor(prize.tokens_amount) for prize in active],
+        [to_weight(prize.drop_chance) for prize in active],
+        lootbox.user_open_rate,
+        lootbox.global_open_rate
+    )
+
+
+async def load_lootbox_sampler(s: AsyncSession, lootbox_id: int) -> LootboxSampler | None:
+    generation = sampler_generation()
+    lootbox = await get_lootbox_by_id(s, lootbox_id)
+    if not lootbox:
+        return None
+    sampler = build_lootbox_sampler(lootbox)
+    cache_sampler(sampler, generation)
+    return sampler
+
+
+async def get_lootbox_sampler(s: AsyncSession, lootbox_id: int) -> LootboxSampler | None:
+    sampler = get_cached_sampler(lootbox_id)
+    if sampler is None:
+        sampler = await load_lootbox_sampler(s, lootbox_id)
+    return sampler
+
+
+async def preload_catalog(s: AsyncSession) -> int:
+    """
+    Одним запросом заполняет снимок каталога и alias-таблицы всех лутбоксов, чтобы первые /lootboxes
+    и открытия после старта воркера не шли в базу.
+
+    :return число загруженных лутбоксов
+    """
+    generation = catalog_generation()
+    samplers_generation = sampler_generation()
+    lootboxes = await get_all_lootboxes(s)
+    cache_catalog(build_catalog(lootboxes), generation)
+    for lootbox in lootboxes:
+        try:
+            cache_sampler(build_lootbox_sampler(lootbox), samplers_generation)
+        except ValueError:
+            # Битые шансы одного лутбокса не должны останавливать старт: его открытия упадут отдельно
+            logger.exception("Cannot build sampler for lootbox %s", lootbox.id)
+    return len(lootboxes)
+
+
 async def create_lootbox(s: AsyncSession, schema: LootboxCreateSchema) -> Lootbox:
     lootbox = Lootbox(**schema.model_dump())
     s.add(lootbox)
+    try:
+        await s.flush()
+    except IntegrityError:
+        await s.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Lootbox with this name already exists")
+    await publish_catalog_change(s, lootbox.id)
     await s.commit()
+    invalidate_sampler(lootbox.id)
+    generation = sampler_generation()
     await s.refresh(lootbox, ['prizes'])
+    cache_sampler(build_lootbox_sampler(lootbox), generation)
+    invalidate_catalog()
     return lootbox
 
 
@@ -78,51 +187,637 @@ async def upload_lootbox_image(s: AsyncSession, lootbox_id: int, file: UploadFil
     lootbox = await get_lootbox_by_id(s, lootbox_id)
     if not lootbox:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lootbox not found")
-    if file.content_type != 'image/png':
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Image should have PNG type")
 
-    async with aiofiles.open(get_file_path(lootbox_id), mode='wb+') as f:
-        while chunk := await file.read(CHUNK_SIZE):
-            await f.write(chunk)
+    data = bytearray()
+    while chunk := await file.read(CHUNK_SIZE):
+        data += chunk
+        if len(data) > IMAGE_MAX_BYTES:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Image is too large")
 
-    lootbox.image_url = f'{PLATFORM_URL}/static/{lootbox_id}.png'
+    try:
+        variants = await process_image(bytes(data), str(lootbox_id))
+    except ImageValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    lootbox.image_variants = [
+        {
+            'width': variant['width'],
+            'format': variant['format'],
+            'url': f"{PLATFORM_URL}/static/lootboxes/{variant['filename']}"
+        }
+        for variant in variants
+    ]
+    lootbox.image_url = next(v['url'] for v in reversed(lootbox.image_variants) if v['format'] == 'png')
+    await publish_catalog_change(s, lootbox_id)
     await s.commit()
+    invalidate_catalog()
     return lootbox
 
 
-async def open_lootbox(schema: LootboxOpenSchema, user: User, s: AsyncSession) -> Prize:
-    lootbox = await get_lootbox_by_id(s, schema.id)
-    if not lootbox:
+async def open_lootbox(schema: LootboxOpenSchema, user: User, s: AsyncSession) -> PrizeReadSchema:
+    sampler = await get_lootbox_sampler(s, schema.id)
+    if not sampler:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lootbox not found")
+
+    if not sampler.prizes:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Lootbox has no prizes")
+
+    i = sampler.draw()
+    prize = sampler.prizes[i]
+
+    drops = notable_drops(user, [prize])
+
+    async with open_limiter.limit(user.address, sampler):
+        balance = await change_balance(s, user, sampler.open_price, sampler.payouts[i])
+        claims = await claim_prizes(s, [prize], user)
+        await record_user_stats(s, user, sampler.open_price, [prize], [sampler.payouts[i]])
+        await publish_drops(s, drops)
+        await s.commit()
+    await claim_log.put(claims)
+    drop_feed.publish(drops)
+    if prize.type == PrizeTypeEnum.NFT:
+        nft_worker.wake()
+    LOOTBOX_OPENS.labels(sampler.lootbox_id).inc()
+    PRIZE_PAYOUTS.labels(sampler.lootbox_id).inc(sampler.payouts[i] / MONEY_SCALE)
+    set_committed_value(user, 'balance', balance)
+    stick_to_primary(user.address)
+    return prize
+
+
+async def open_lootbox_batch(
+        schema: LootboxOpenBatchSchema,
+        user: User,
+        s: AsyncSession
+) -> list[PrizeReadSchema]:
+    sampler = await get_lootbox_sampler(s, schema.id)
+    if not sampler:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lootbox not found")
 
-    if len(lootbox.prizes) == 0:
+    if not sampler.prizes:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Lootbox has no prizes")
 
-    if user.balance < lootbox.open_price:
+    draws = sampler.draw_many(schema.count)
+    prizes = [sampler.prizes[i] for i in draws]
+    payouts = [sampler.payouts[i] for i in draws]
+    payout = sum(payouts)
+
+    drops = notable_drops(user, prizes)
+
+    async with open_limiter.limit(user.address, sampler, schema.count):
+        balance = await change_balance(s, user, sampler.open_price * schema.count, payout)
+        claims = await claim_prizes(s, prizes, user)
+        await record_user_stats(s, user, sampler.open_price * schema.count, prizes, payouts)
+        await publish_drops(s, drops)
+        await s.commit()
+    await claim_log.put(claims)
+    drop_feed.publish(drops)
+    if any(prize.type == PrizeTypeEnum.NFT for prize in prizes):
+        nft_worker.wake()
+    LOOTBOX_OPENS.labels(sampler.lootbox_id).inc(schema.count)
+    PRIZE_PAYOUTS.labels(sampler.lootbox_id).inc(payout / MONEY_SCALE)
+    set_committed_value(user, 'balance', balance)
+    stick_to_primary(user.address)
+    return prizes
+
+
+async def change_balance(s: AsyncSession, user: User, debit: int, credit: int) -> Decimal:
+    """
+    Атомарно списывает debit и начисляет credit (в минимальных единицах) одним условным UPDATE.
+    Строка пользователя не блокируется дольше самого запроса, конкурентные открытия не теряют обновления.
+    С шиной инвалидации новый баланс рассылается другим воркерам из того же RETURNING.
+
+    :return новый баланс
+    """
+    returning = [User.balance]
+    if bus.enabled:
+        returning.append(func.pg_notify(
+            USERS_CHANNEL,
+            func.json_build_object('address', User.address, 'balance', User.balance, 'origin', bus.origin).cast(Text)
+        ))
+    balance = await s.scalar(
+        update(User)
+        .filter(User.id == user.id, User.balance >= minor(debit))
+        .values(balance=User.balance - minor(debit) + minor(credit))
+        .returning(*returning)
+        .execution_options(synchronize_session=False)
+    )
+    if balance is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not enough balance")
+    return balance
+
 
-    user.balance -= lootbox.open_price
+async def claim_prizes(s: AsyncSession, prizes: list[PrizeReadSchema], user: User) -> list[ClaimRecord]:
+    """
+    Записывает выигранные призы в текущей транзакции.
+    В режиме write-behind возвращает записи, которые нужно передать в claim_log после коммита.
+    NFT всегда пишутся сразу: доставке нужен id выигрыша.
+    """
+    nfts = [prize for prize in prizes if prize.type == PrizeTypeEnum.NFT]
+    if nfts:
+        await create_nft_deliveries(s, nfts, user)
+    tokens = [prize for prize in prizes if prize.type == PrizeTypeEnum.TOKENS]
+    if not tokens:
+        return []
+    if claim_log.enabled:
+        claim_date = datetime.now()
+        return [(prize.id, user.id, claim_date) for prize in tokens]
+    await s.execute(insert(ClaimedPrize), [{'prize_id': prize.id, 'user_id': user.id} for prize in tokens])
+    return []
 
-    weights = [float(prize.drop_chance) for prize in lootbox.prizes]
-    prize = random.choices(lootbox.prizes, weights=weights, k=1)[0]
 
-    await claim_prize(s, prize, user)
+async def create_nft_deliveries(s: AsyncSession, prizes: list[PrizeReadSchema], user: User):
+    """
+    Ставит NFT в очередь доставки в текущей транзакции; минтит их nft_worker после коммита.
+    """
+    claim_ids = (await s.execute(
+        insert(ClaimedPrize).returning(ClaimedPrize.id, sort_by_parameter_order=True),
+        [{'prize_id': prize.id, 'user_id': user.id} for prize in prizes]
+    )).scalars().all()
+    await s.execute(insert(NftDelivery), [
+        {
+            'claimed_prize_id': claim_id,
+            'prize_id': prize.id,
+            'address': user.address,
+            'idempotency_key': f'claim-{claim_id}'
+        }
+        for claim_id, prize in zip(claim_ids, prizes)
+    ])
+
+
+async def get_nft_delivery_counts(s: AsyncSession) -> dict[str, int]:
+    rows = await s.execute(select(NftDelivery.status, func.count()).group_by(NftDelivery.status))
+    return {status_: count for status_, count in rows}
+
+
+async def retry_failed_nft_deliveries(s: AsyncSession) -> int:
+    """
+    Возвращает исчерпавшие попытки доставки в очередь с новым счётчиком попыток.
+    """
+    result = await s.execute(
+        update(NftDelivery)
+        .filter(NftDelivery.status == NftDeliveryStatusEnum.failed.value)
+        .values(
+            status=NftDeliveryStatusEnum.pending.value,
+            attempts=0,
+            next_attempt_at=func.now(),
+            updated_at=func.now()
+        )
+        .execution_options(synchronize_session=False)
+    )
     await s.commit()
-    return prize
+    nft_worker.wake()
+    return result.rowcount
 
 
-async def claim_prize(s: AsyncSession, prize: Prize, user: User):
-    if prize.type == PrizeTypeEnum.TOKENS.value:
-        user.balance += prize.tokens_amount
+def quality_count_column(quality: PrizeQualityEnum) -> str:
+    return f'{quality.name}_count'
+
+
+async def record_user_stats(
+        s: AsyncSession,
+        user: User,
+        spent: int,
+        prizes: list[PrizeReadSchema],
+        payouts: list[int]
+):
+    """
+    Прибавляет открытия к агрегату user_stats в текущей транзакции одним upsert.
+    Суммы передаются в минимальных единицах.
+    """
+    counts = {quality_count_column(quality): 0 for quality in PrizeQualityEnum}
+    for prize in prizes:
+        counts[quality_count_column(prize.quality)] += 1
+    best = max(range(len(prizes)), key=lambda i: payouts[i])
+
+    stmt = pg_insert(UserStats).values(
+        user_id=user.id,
+        opened=len(prizes),
+        spent=minor(spent),
+        won=minor(sum(payouts)),
+        best_prize_id=prizes[best].id,
+        best_tokens_amount=minor(payouts[best]),
+        **counts
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={
+            'opened': UserStats.opened + stmt.excluded.opened,
+            'spent': UserStats.spent + stmt.excluded.spent,
+            'won': UserStats.won + stmt.excluded.won,
+            **{column: getattr(UserStats, column) + getattr(stmt.excluded, column) for column in counts},
+            'best_prize_id': case(
+                (stmt.excluded.best_tokens_amount > UserStats.best_tokens_amount, stmt.excluded.best_prize_id),
+                else_=UserStats.best_prize_id
+            ),
+            'best_tokens_amount': func.greatest(UserStats.best_tokens_amount, stmt.excluded.best_tokens_amount),
+        }
+    )
+    await s.execute(stmt)
+
+
+async def get_user_stats(s: AsyncSession, user: User) -> UserStatsReadSchema:
+    stats = await s.scalar(
+        select(UserStats).filter(UserStats.user_id == user.id).options(joinedload(UserStats.best_prize))
+    )
+    if not stats:
+        return UserStatsReadSchema()
+    return UserStatsReadSchema(
+        opened=stats.opened,
+        spent=stats.spent,
+        won=stats.won,
+        opened_by_quality={quality: getattr(stats, quality_count_column(quality)) for quality in PrizeQualityEnum},
+        best_prize=PrizeReadSchema.model_validate(stats.best_prize, from_attributes=True) if stats.best_prize else None
+    )
+
+
+async def backfill_user_stats(s: AsyncSession) -> int:
+    """
+    Пересчитывает user_stats по истории claimed_prizes, заменяя текущие значения.
+    Учитываются только секции в базе: заархивированные месяцы в пересчёт не попадают.
+    Потраченное считается по текущей цене лутбокса: цена на момент открытия в истории не хранится.
+    Запускать, когда открытия остановлены и очередь write-behind пуста.
+
+    :return число пересчитанных пользователей
+    """
+    counts = {
+        quality_count_column(quality): func.count().filter(Prize.quality == quality.value)
+        for quality in PrizeQualityEnum
+    }
+    totals = (
+        select(
+            ClaimedPrize.user_id,
+            func.count().label('opened'),
+            func.sum(Lootbox.open_price).label('spent'),
+            func.sum(Prize.tokens_amount).label('won'),
+            *[count.label(column) for column, count in counts.items()]
+        )
+        .join(Prize, Prize.id == ClaimedPrize.prize_id)
+        .join(Lootbox, Lootbox.id == Prize.lootbox_id)
+        .group_by(ClaimedPrize.user_id)
+        .subquery()
+    )
+    best = (
+        select(ClaimedPrize.user_id, Prize.id.label('prize_id'), Prize.tokens_amount)
+        .join(Prize, Prize.id == ClaimedPrize.prize_id)
+        .distinct(ClaimedPrize.user_id)
+        .order_by(ClaimedPrize.user_id, Prize.tokens_amount.desc())
+        .subquery()
+    )
+    columns = ['user_id', 'opened', 'spent', 'won', *counts, 'best_prize_id', 'best_tokens_amount']
+    stmt = pg_insert(UserStats).from_select(
+        columns,
+        select(
+            totals.c.user_id, totals.c.opened, totals.c.spent, totals.c.won,
+            *[totals.c[column] for column in counts],
+            best.c.prize_id, best.c.tokens_amount
+        ).join(best, best.c.user_id == totals.c.user_id)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={column: getattr(stmt.excluded, column) for column in columns if column != 'user_id'}
+    ).returning(UserStats.user_id)
+    users = len((await s.execute(stmt)).all())
+    await s.commit()
+    return users
+
+
+def encode_claimed_prizes_cursor(claimed_prize: ClaimedPrize) -> str:
+    raw = f"{claimed_prize.claim_date.isoformat()}|{claimed_prize.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_claimed_prizes_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        claim_date, claimed_prize_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(claim_date), int(claimed_prize_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+async def get_user_claimed_prizes(
+        s: AsyncSession,
+        user: User,
+        limit: int,
+        cursor: str | None = None,
+        quality: PrizeQualityEnum | None = None,
+        prize_type: PrizeTypeEnum | None = None
+) -> tuple[Sequence[ClaimedPrize], str | None]:
+    """
+    Страница истории призов пользователя, от новых к старым.
+    Keyset-пагинация по (claim_date, id) идёт по индексу ix_claimed_prizes_user_history;
+    секции обходятся от новых к старым, и страница обычно читает одну-две последние.
+
+    :return призы страницы и курсор следующей страницы
+    """
+    query = select(ClaimedPrize).filter(ClaimedPrize.user_id == user.id)
+    if quality or prize_type:
+        query = query.join(ClaimedPrize.prize).options(contains_eager(ClaimedPrize.prize))
+        if quality:
+            query = query.filter(Prize.quality == quality.value)
+        if prize_type:
+            query = query.filter(Prize.type == prize_type.value)
     else:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Other prize types not implemented yet")
-    claimed_prize = ClaimedPrize(prize=prize, user=user)
-    s.add(claimed_prize)
-    return
+        query = query.options(joinedload(ClaimedPrize.prize))
+    query = query.options(joinedload(ClaimedPrize.delivery))
+    if cursor:
+        claim_date, claimed_prize_id = decode_claimed_prizes_cursor(cursor)
+        # Отдельное условие на claim_date отсекает более новые секции: по сравнению кортежей Postgres их не отбрасывает
+        query = query.filter(
+            ClaimedPrize.claim_date <= claim_date,
+            tuple_(ClaimedPrize.claim_date, ClaimedPrize.id) < tuple_(claim_date, claimed_prize_id)
+        )
+    query = query.order_by(ClaimedPrize.claim_date.desc(), ClaimedPrize.id.desc()).limit(limit + 1)
 
+    claimed_prizes = (await s.execute(query)).scalars().all()
+    if len(claimed_prizes) > limit:
+        claimed_prizes = claimed_prizes[:limit]
+        return claimed_prizes, encode_claimed_prizes_cursor(claimed_prizes[-1])
+    return claimed_prizes, None
 
-async def get_user_claimed_prizes(s: AsyncSession, user: User) -> Sequence[ClaimedPrize]:
-    claimed_prizes = await s.execute(
-        select(ClaimedPrize).filter(ClaimedPrize.user_id == user.id).options(joinedload(ClaimedPrize.prize))
+
+async def run_simulation(
+        open_price: Decimal,
+        drop_chances: Sequence[Decimal],
+        payouts: Sequence[Decimal],
+        params: SimulationParamsSchema
+) -> dict:
+    try:
+        return await run_in_threadpool(
+            simulate_lootbox,
+            float(open_price),
+            [float(chance) for chance in drop_chances],
+            [float(payout) for payout in payouts],
+            draws=params.draws,
+            sessions=params.sessions,
+            session_opens=params.session_opens,
+            bankroll=float(params.bankroll) if params.bankroll is not None else None,
+            seed=params.seed
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+async def simulate_existing_lootbox(s: AsyncSession, lootbox_id: int, params: SimulationParamsSchema) -> dict:
+    sampler = await get_lootbox_sampler(s, lootbox_id)
+    if not sampler:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lootbox not found")
+    if not sampler.prizes:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Lootbox has no prizes")
+    return await run_simulation(
+        from_minor(sampler.open_price),
+        [prize.drop_chance for prize in sampler.prizes],
+        [from_minor(payout) for payout in sampler.payouts],
+        params
     )
-    return claimed_prizes.scalars().all()
\ No newline at end of file
+
+
+async def simulate_draft_lootbox(schema: SimulationDraftSchema) -> dict:
+    return await run_simulation(
+        schema.open_price,
+        [prize.drop_chance for prize in schema.prizes],
+        [prize.tokens_amount for prize in schema.prizes],
+        schema
+    )
+
+
+async def get_drop_rate_report(
+        s: AsyncSession,
+        lootbox_id: int | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None
+) -> list[LootboxDropRateSchema]:
+    """
+    Наблюдаемые частоты выпадения против настроенных по почасовым drop_rollups, без чтения claimed_prizes.
+    Приз помечается, если настроенный шанс вне доверительного интервала Уилсона, лутбокс — по хи-квадрат;
+    оба на уровне значимости ANALYTICS_ALPHA.
+    """
+    opens = select(DropRollup.prize_id, func.sum(DropRollup.opens)).group_by(DropRollup.prize_id)
+    query = select(Lootbox).options(selectinload(Lootbox.prizes)).order_by(Lootbox.id)
+    if lootbox_id is not None:
+        opens = opens.filter(DropRollup.lootbox_id == lootbox_id)
+        query = query.filter(Lootbox.id == lootbox_id)
+    if since:
+        opens = opens.filter(DropRollup.hour >= since)
+    if until:
+        opens = opens.filter(DropRollup.hour < until)
+    counts = {prize_id: int(count) for prize_id, count in await s.execute(opens)}
+    z = NormalDist().inv_cdf(1 - ANALYTICS_ALPHA / 2)
+
+    report = []
+    for lootbox in (await s.execute(query)).scalars().all():
+        prizes = sorted(lootbox.prizes, key=lambda prize: prize.id)
+        total_chance = sum(float(prize.drop_chance) for prize in prizes)
+        if not total_chance:
+            continue
+        n = sum(counts.get(prize.id, 0) for prize in prizes)
+        chi_square, degrees_of_freedom, prize_rates = 0.0, -1, []
+        for prize in prizes:
+            rate = float(prize.drop_chance) / total_chance
+            observed = counts.get(prize.id, 0)
+            expected = n * rate
+            low, high = wilson_interval(observed, n, z)
+            if expected > 0:
+                chi_square += (observed - expected) ** 2 / expected
+                degrees_of_freedom += 1
+            prize_rates.append(PrizeDropRateSchema(
+                prize_id=prize.id,
+                name=prize.name,
+                quality=prize.quality,
+                configured_rate=rate,
+                observed=observed,
+                observed_rate=observed / n if n else 0.0,
+                expected=expected,
+                confidence_low=low,
+                confidence_high=high,
+                flagged=n > 0 and not low <= rate <= high
+            ))
+        p_value = chi_square_p_value(chi_square, degrees_of_freedom) if n and degrees_of_freedom >= 1 else None
+        report.append(LootboxDropRateSchema(
+            lootbox_id=lootbox.id,
+            name=lootbox.name,
+            opens=n,
+            chi_square=chi_square if p_value is not None else None,
+            degrees_of_freedom=max(degrees_of_freedom, 0),
+            p_value=p_value,
+            flagged=p_value is not None and p_value < ANALYTICS_ALPHA,
+            prizes=prize_rates
+        ))
+    return report
+
+
+async def get_lootbox_timeseries(
+        s: AsyncSession,
+        lootbox_id: int,
+        bucket: Literal['hour', 'day'] = 'hour',
+        since: datetime | None = None,
+        until: datetime | None = None
+) -> LootboxTimeseriesSchema:
+    period = func.date_trunc(bucket, DropRollup.hour).label('bucket')
+    query = (
+        select(period, func.sum(DropRollup.opens), func.sum(DropRollup.revenue), func.sum(DropRollup.payout))
+        .filter(DropRollup.lootbox_id == lootbox_id)
+        .group_by(period)
+        .order_by(period)
+    )
+    if since:
+        query = query.filter(DropRollup.hour >= since)
+    if until:
+        query = query.filter(DropRollup.hour < until)
+    points = [
+        LootboxTimeseriesPointSchema(
+            bucket=period_start,
+            opens=int(opens),
+            revenue=revenue,
+            payout=payout,
+            rtp=float(payout / revenue) if revenue else None
+        )
+        for period_start, opens, revenue, payout in await s.execute(query)
+    ]
+    return LootboxTimeseriesSchema(lootbox_id=lootbox_id, points=points)
+
+
+async def import_catalog(s: AsyncSession, catalog: CatalogSchema) -> CatalogImportResultSchema:
+    """
+    Upsert лутбоксов по name и призов по (lootbox_id, name) многострочными INSERT ... ON CONFLICT
+    в одной транзакции. Строка, которая не изменилась, не обновляется и не возвращается RETURNING,
+    поэтому по числу возвращённых строк считается разница с текущим каталогом.
+
+    Набор призов импортированного лутбокса заменяется целиком: призы, которых нет в документе,
+    получают нулевой шанс. Удалить их нельзя, на них ссылается история открытий.
+    """
+    result = CatalogImportResultSchema()
+    if not catalog.lootboxes:
+        return result
+
+    lootbox_ids: dict[str, int] = {}
+    for i in range(0, len(catalog.lootboxes), CATALOG_IMPORT_CHUNK):
+        chunk = catalog.lootboxes[i:i + CATALOG_IMPORT_CHUNK]
+        stmt = pg_insert(Lootbox).values([
+            lootbox.model_dump(include={'name', 'open_price', 'user_open_rate', 'global_open_rate'}) for lootbox in chunk
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Lootbox.name],
+            set_={
+                'open_price': stmt.excluded.open_price,
+                'user_open_rate': stmt.excluded.user_open_rate,
+                'global_open_rate': stmt.excluded.global_open_rate,
+            },
+            where=or_(
+                Lootbox.open_price.is_distinct_from(stmt.excluded.open_price),
+                Lootbox.user_open_rate.is_distinct_from(stmt.excluded.user_open_rate),
+                Lootbox.global_open_rate.is_distinct_from(stmt.excluded.global_open_rate),
+            )
+        ).returning(Lootbox.id, Lootbox.name, literal_column('xmax = 0').label('created'))
+        for row in await s.execute(stmt):
+            lootbox_ids[row.name] = row.id
+            if row.created:
+                result.lootboxes_created += 1
+            else:
+                result.lootboxes_updated += 1
+    result.lootboxes_unchanged = len(catalog.lootboxes) - len(lootbox_ids)
+
+    missing = [lootbox.name for lootbox in catalog.lootboxes if lootbox.name not in lootbox_ids]
+    if missing:
+        lootbox_ids.update(
+            (name, lootbox_id)
+            for lootbox_id, name in await s.execute(select(Lootbox.id, Lootbox.name).filter(Lootbox.name.in_(missing)))
+        )
+
+    prizes = [
+        {
+            'lootbox_id': lootbox_ids[lootbox.name],
+            'name': prize.name,
+            'quality': prize.quality.value,
+            'drop_chance': prize.drop_chance,
+            'type': prize.type.value,
+            'tokens_amount': prize.tokens_amount,
+        }
+        for lootbox in catalog.lootboxes
+        for prize in lootbox.prizes
+    ]
+    for i in range(0, len(prizes), CATALOG_IMPORT_CHUNK):
+        stmt = pg_insert(Prize).values(prizes[i:i + CATALOG_IMPORT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Prize.lootbox_id, Prize.name],
+            set_={
+                'quality': stmt.excluded.quality,
+                'drop_chance': stmt.excluded.drop_chance,
+                'type': stmt.excluded.type,
+                'tokens_amount': stmt.excluded.tokens_amount,
+            },
+            where=or_(
+                Prize.quality.is_distinct_from(stmt.excluded.quality),
+                Prize.drop_chance.is_distinct_from(stmt.excluded.drop_chance),
+                Prize.type.is_distinct_from(stmt.excluded.type),
+                Prize.tokens_amount.is_distinct_from(stmt.excluded.tokens_amount),
+            )
+        ).returning(literal_column('xmax = 0').label('created'))
+        for row in await s.execute(stmt):
+            if row.created:
+                result.prizes_created += 1
+            else:
+                result.prizes_updated += 1
+    result.prizes_unchanged = len(prizes) - result.prizes_created - result.prizes_updated
+
+    listed = select(
+        func.unnest(literal([prize['lootbox_id'] for prize in prizes], ARRAY(Integer))),
+        func.unnest(literal([prize['name'] for prize in prizes], ARRAY(Text)))
+    )
+    retired = await s.execute(
+        update(Prize)
+        .where(
+            Prize.lootbox_id == any_(literal(list(lootbox_ids.values()), ARRAY(Integer))),
+            Prize.drop_chance != 0,
+            tuple_(Prize.lootbox_id, Prize.name).not_in(listed)
+        )
+        .values(drop_chance=0)
+    )
+    result.prizes_removed = retired.rowcount
+
+    await publish_catalog_change(s)
+    await s.commit()
+    invalidate_sampler()
+    invalidate_catalog()
+    return result
+
+
+async def iter_catalog() -> AsyncIterator[dict]:
+    """
+    Потоково читает каталог в формате CatalogSchema, по одному лутбоксу.
+    Открывает свою сессию: ответ отдаётся уже после закрытия сессии запроса.
+    """
+    async with async_session_maker() as s:
+        rows = await s.stream(
+            select(Lootbox.id, Lootbox.name, Lootbox.open_price, Lootbox.user_open_rate, Lootbox.global_open_rate,
+                   Prize.name, Prize.quality, Prize.drop_chance, Prize.type, Prize.tokens_amount)
+            .outerjoin(Prize, and_(Prize.lootbox_id == Lootbox.id, Prize.drop_chance > 0))
+            .order_by(Lootbox.id, Prize.id)
+            .execution_options(yield_per=1000)
+        )
+        lootbox = None
+        async for row in rows:
+            lootbox_id, name, open_price, user_open_rate, global_open_rate, *prize_row = row
+            prize_name, quality, drop_chance, prize_type, tokens_amount = prize_row
+            if lootbox is None or lootbox['id'] != lootbox_id:
+                if lootbox is not None:
+                    lootbox.pop('id')
+                    yield lootbox
+                lootbox = {
+                    'id': lootbox_id,
+                    'name': name,
+                    'open_price': open_price,
+                    'user_open_rate': user_open_rate,
+                    'global_open_rate': global_open_rate,
+                    'prizes': []
+                }
+            if prize_name is not None:
+                lootbox['prizes'].append({
+                    'name': prize_name,
+                    'quality': quality,
+                    'drop_chance': drop_chance,
+                    'type': prize_type,
+                    'tokens_amount': tokens_amount,
+                })
+        if lootbox is not None:
+            lootbox.pop('id')
+            yield lootbox
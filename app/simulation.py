@@ -0,0 +1,99 @@
+import time
+from typing import Sequence
+import numpy as np
+
+PERCENTILES = (1, 5, 10, 25, 50, 75, 90, 95, 99)
+DRAW_CHUNK = 2_000_000
+SESSION_CHUNK_CELLS = 4_000_000
+# Бюджет по умолчанию: хватает на столько открытий без выигрышей. Бюджет на всю сессию разориться не даёт никогда
+DEFAULT_BANKROLL_OPENS = 10
+
+
+def simulate_lootbox(
+        open_price: float,
+        drop_chances: Sequence[float],
+        payouts: Sequence[float],
+        draws: int = 10_000_000,
+        sessions: int = 10_000,
+        session_opens: int = 100,
+        bankroll: float | None = None,
+        checkpoints: int = 10,
+        seed: int | None = None
+) -> dict:
+    """
+    Монте-Карло экономики лутбокса на NumPy.
+
+    Одиночные открытия дают наблюдаемые частоты призов, среднюю выплату и дисперсию,
+    сессии из session_opens открытий подряд — распределение итога игрока, кривые перцентилей
+    и вероятность разорения: баланс опускается ниже open_price раньше конца сессии.
+    Без bankroll бюджет — DEFAULT_BANKROLL_OPENS открытий.
+    """
+    chances = np.asarray(drop_chances, dtype=np.float64)
+    prize_payouts = np.asarray(payouts, dtype=np.float64)
+    if chances.size == 0 or chances.size != prize_payouts.size:
+        raise ValueError("Lootbox should have prizes with chances and payouts")
+    if (chances < 0).any() or chances.sum() <= 0:
+        raise ValueError("Drop chances should be non-negative with a positive sum")
+
+    probabilities = chances / chances.sum()
+    cdf = np.cumsum(probabilities)
+    cdf[-1] = 1.0
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+
+    counts = np.zeros(chances.size, dtype=np.int64)
+    remaining = draws
+    while remaining > 0:
+        chunk = min(remaining, DRAW_CHUNK)
+        counts += np.bincount(np.searchsorted(cdf, rng.random(chunk), side='right'), minlength=chances.size)
+        remaining -= chunk
+    observed_mean = float(counts @ prize_payouts / draws) if draws else None
+    observed_variance = float(counts @ (prize_payouts - observed_mean) ** 2 / draws) if draws else None
+
+    if bankroll is None:
+        bankroll = open_price * min(DEFAULT_BANKROLL_OPENS, session_opens)
+    step_indexes = np.unique(np.linspace(1, session_opens, min(checkpoints, session_opens)).astype(np.int64)) - 1
+    finals, curves, ruined = [], [], 0
+    rows_per_chunk = max(1, SESSION_CHUNK_CELLS // max(session_opens, 1))
+    remaining = sessions
+    while remaining > 0:
+        rows = min(remaining, rows_per_chunk)
+        indexes = np.searchsorted(cdf, rng.random((rows, session_opens)), side='right')
+        net = np.cumsum(prize_payouts[indexes] - open_price, axis=1)
+        balances = bankroll + net[:, :-1]
+        ruined += rows if bankroll < open_price else int(np.count_nonzero((balances < open_price).any(axis=1)))
+        finals.append(net[:, -1])
+        curves.append(net[:, step_indexes])
+        remaining -= rows
+    finals = np.concatenate(finals) if finals else np.zeros(0)
+    curves = np.concatenate(curves) if curves else np.zeros((0, step_indexes.size))
+
+    expected_payout = float(probabilities @ prize_payouts)
+    payout_variance = float(probabilities @ (prize_payouts - expected_payout) ** 2)
+    return {
+        'open_price': open_price,
+        'draws': draws,
+        'sessions': sessions,
+        'session_opens': session_opens,
+        'bankroll': bankroll,
+        'expected_payout': expected_payout,
+        'house_edge': (open_price - expected_payout) / open_price if open_price else None,
+        'payout_variance': payout_variance,
+        'payout_std': payout_variance ** 0.5,
+        'observed_mean_payout': observed_mean,
+        'observed_payout_variance': observed_variance,
+        'observed_drop_rates': (counts / draws).tolist() if draws else [],
+        'configured_drop_rates': probabilities.tolist(),
+        'ruin_probability': ruined / sessions if sessions else None,
+        'session_net_percentiles': {
+            str(q): float(v) for q, v in zip(PERCENTILES, np.percentile(finals, PERCENTILES))
+        } if finals.size else {},
+        'percentile_curves': [
+            {
+                'opens': int(step + 1),
+                'net': {str(q): float(v) for q, v in zip(PERCENTILES, np.percentile(curves[:, j], PERCENTILES))}
+            }
+            for j, step in enumerate(step_indexes)
+        ] if curves.size else [],
+        'seconds': time.perf_counter() - started,
+    }
@@ -1,31 +1,73 @@
 import datetime
+from typing import AsyncGenerator
 import jwt
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 from starlette import status
 
 from models import User
 from service import get_user_by_address
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_DAYS
-from db import get_async_session
+from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_DAYS, USER_CACHE_SIZE, USER_CACHE_TTL, ADMIN_ADDRESS
+from db import async_session_maker, session_maker_for, stick_to_primary
+from cache import TTLCache
+from fixed_point import from_minor
+from invalidation import bus, USERS_CHANNEL
 
 security = HTTPBearer()
 
+# Отсоединённые от сессии объекты User по адресу кошелька.
+# Баланс в них обновляется через set_committed_value после каждого изменения в service.
+user_cache: TTLCache[str, User] = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
 
-async def get_current_user(
-        credentials: HTTPAuthorizationCredentials = Depends(security),
-        s: AsyncSession = Depends(get_async_session)
-) -> User:
+
+def update_cached_balance(event: dict):
+    stick_to_primary(event['address'])
+    user = user_cache.get(event['address'])
+    if user is not None:
+        set_committed_value(user, 'balance', from_minor(event['balance']))
+
+
+bus.subscribe(USERS_CHANNEL, update_cached_balance)
+bus.on_resync(user_cache.clear)
+
+
+async def load_user(address: str) -> User | None:
+    """
+    Читает пользователя с реплики, а если его там нет — с primary: первый вход мог обработать другой воркер,
+    и реплика ещё не получила запись. Найденного на primary пользователя воркер дальше читает с primary.
+    """
+    session_maker = session_maker_for(address)
+    async with session_maker() as s:
+        user = await get_user_by_address(s, address)
+        if user:
+            s.expunge(user)
+            return user
+    if session_maker is async_session_maker:
+        return None
+    async with async_session_maker() as s:
+        user = await get_user_by_address(s, address)
+        if not user:
+            return None
+        s.expunge(user)
+    stick_to_primary(address)
+    return user
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     token = credentials.credentials
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         address = payload.get("wallet_address")
         if not address:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        user = await get_user_by_address(s, address)
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        user = user_cache.get(address)
+        if user is None:
+            user = await load_user(address)
+            if not user:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+            user_cache.set(address, user)
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
@@ -33,8 +75,31 @@ async def get_current_user(
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
 
+async def get_user_read_session(user: User = Depends(get_current_user)) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Читающая сессия для эндпоинтов пользователя: сразу после его записи читает из primary.
+    """
+    async with session_maker_for(user.address)() as session:
+        yield session
+
+
+def is_admin_address(address: str) -> bool:
+    return address.lower() == ADMIN_ADDRESS.lower()
+
+
+def is_admin_token(token: str) -> bool:
+    """
+    Проверка без запроса к базе для мест вне FastAPI-зависимостей (мидлвари).
+    """
+    try:
+        address = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("wallet_address")
+    except jwt.InvalidTokenError:
+        return False
+    return bool(address) and is_admin_address(address)
+
+
 async def get_admin_user(user: User = Depends(get_current_user)):
-    if user.address.lower() != '0x6297d5267f39c99991e70465e7cbf6f6f5f8f6f4':
+    if not is_admin_address(user.address):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Access denied")
     return user
 
@@ -0,0 +1,49 @@
+import logging
+import time
+from prometheus_client import REGISTRY
+from config import DB_WARMUP_CONNECTIONS
+from db import engine, read_engine, async_session_maker, warm_pool
+from metrics import StatsCollector
+from service import preload_catalog
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """
+    Прогрев воркера перед приёмом трафика: соединения пулов primary и реплики, снимок каталога и alias-таблицы.
+    ready становится True, когда lifespan закончил старт, и снова False в начале остановки,
+    чтобы балансировщик снял воркер с трафика до того, как он перестанет отвечать.
+    """
+
+    def __init__(self, connections: int):
+        self.connections = connections
+        self.ready = False
+        self.seconds = 0.0
+        self.opened = 0
+        self.lootboxes = 0
+
+    def stats(self) -> dict:
+        return {
+            'ready': self.ready,
+            'seconds': self.seconds,
+            'connections': self.opened,
+            'lootboxes': self.lootboxes,
+        }
+
+    async def run(self):
+        started = time.perf_counter()
+        self.opened = await warm_pool(engine, self.connections)
+        if read_engine is not engine:
+            self.opened += await warm_pool(read_engine, self.connections)
+        # Каталог и сэмплеры живут до инвалидации, поэтому читаются с primary: реплика может отставать
+        async with async_session_maker() as s:
+            self.lootboxes = await preload_catalog(s)
+        self.seconds = time.perf_counter() - started
+        logger.info(
+            "Warm-up done in %.3fs: %s connections, %s lootboxes", self.seconds, self.opened, self.lootboxes
+        )
+
+
+warmup = Warmup(DB_WARMUP_CONNECTIONS)
+REGISTRY.register(StatsCollector('warmup', warmup.stats))
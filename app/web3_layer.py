@@ -1,14 +1,52 @@
+import asyncio
 import base64
 import hashlib
-from datetime import datetime
-import jwt
+import hmac
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 from nacl.exceptions import BadSignatureError
 from nacl.signing import VerifyKey
+from prometheus_client import REGISTRY
 from starlette import status
-from config import SECRET_KEY, ALGORITHM
+from cache import TTLCache
+from config import SECRET_KEY, TON_PROOF_TTL, TON_PROOF_CLOCK_SKEW, TON_PROOF_DOMAINS, TON_PROOF_WORKERS, \
+    TON_PROOF_MAX_PENDING, TON_PROOF_QUEUE_WAIT, TON_PROOF_REPLAY_SIZE
+from metrics import AUTH_VERIFICATIONS, AUTH_VERIFY_FAILURES, AUTH_VERIFY_LATENCY, StatsCollector
 from schemas import TonProofItem, TonPayload
 
+# nonce: срок действия (4 байта) + случайные 8 байт + усечённый HMAC-SHA256 (12 байт), 32 символа base64url
+NONCE_KEY = hashlib.sha256(SECRET_KEY.encode() + b'/ton-proof-nonce').digest()
+NONCE_RANDOM_BYTES = 8
+NONCE_MAC_BYTES = 12
+NONCE_BYTES = 4 + NONCE_RANDOM_BYTES + NONCE_MAC_BYTES
+
+
+def nonce_mac(body: bytes) -> bytes:
+    return hmac.new(NONCE_KEY, body, hashlib.sha256).digest()[:NONCE_MAC_BYTES]
+
+
+def generate_ton_payload(ttl: int = TON_PROOF_TTL) -> TonPayload:
+    body = int(time.time() + ttl).to_bytes(4, byteorder='big') + os.urandom(NONCE_RANDOM_BYTES)
+    return TonPayload(payload=base64.urlsafe_b64encode(body + nonce_mac(body)).decode())
+
+
+def parse_nonce(payload: str) -> int | None:
+    """
+    :return срок действия nonce (unix time), None если nonce выдан не нами или повреждён
+    """
+    try:
+        raw = base64.b64decode(payload, altchars=b'-_', validate=True)
+    except ValueError:
+        return None
+    if len(raw) != NONCE_BYTES:
+        return None
+    body, mac = raw[:-NONCE_MAC_BYTES], raw[-NONCE_MAC_BYTES:]
+    if not hmac.compare_digest(mac, nonce_mac(body)):
+        return None
+    return int.from_bytes(body[:4], byteorder='big')
+
 
 def verify_signature(key, message, signature):
     verify_key = VerifyKey(key)
@@ -19,32 +57,13 @@ def verify_signature(key, message, signature):
         return False
 
 
-def generate_ton_payload(ttl: int = 600) -> TonPayload:
-    payload = {
-        "data": "Auth on NFT lootboxes",
-        "exp": int(datetime.now().timestamp()) + ttl
-    }
-    return TonPayload(payload=jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM))
-
-
-def verify_ton_proof(proof: TonProofItem) -> str:
+def check_proof_signature(proof: TonProofItem) -> bool:
     """
-    Проверяет подпись TON Proof.
+    Проверяет подпись TON Proof. Выполняется в пуле потоков: libsodium через cffi отпускает GIL.
 
-    :param proof: Объект с данными подписи (payload, signature, domain, timestamp и т.д.)
-    :return address
+    :raise ValueError: если адрес, ключ или подпись не разбираются, или workchain не помещается в int32
     """
-
-    # TODO check proof.proof.domain
-    try:
-        jwt.decode(proof.proof.payload, SECRET_KEY, algorithms=[ALGORITHM])
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError) as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid payload: {e}")
-
-    if proof.proof.timestamp < datetime.now().timestamp() / 1000:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Proof expired")
-
-    pubkey_bytes = bytes(bytearray.fromhex(proof.public_key))
+    pubkey_bytes = bytes.fromhex(proof.public_key)
 
     # Извлекаем workchain и хэш адреса
     workchain, address = proof.address.split(':')
@@ -52,36 +71,148 @@ def verify_ton_proof(proof: TonProofItem) -> str:
 
     # Подготавливаем данные для подписи
     ton_proof_prefix = b"ton-proof-item-v2/"
-    wc = int(workchain).to_bytes(4, byteorder='big')
+    try:
+        wc = int(workchain).to_bytes(4, byteorder='big', signed=True)
+    except OverflowError:
+        raise ValueError(f"Workchain {workchain} is out of range")
     ts = int(proof.proof.timestamp).to_bytes(8, byteorder='little')
-    dl = proof.proof.domain.lengthBytes.to_bytes(4, byteorder='little')
+    domain = proof.proof.domain.value.encode('utf-8')
+    dl = len(domain).to_bytes(4, byteorder='little')
 
     # Собираем сообщение для хэширования
-    msg = (
-        ton_proof_prefix +
-        wc +
-        address_hash +
-        dl +
-        proof.proof.domain.value.encode('utf-8') +
-        ts +
-        proof.proof.payload.encode('utf-8')
-    )
-
-    # Хэшируем сообщение с помощью SHA-256
-    msg_hash = hashlib.sha256(msg).digest()
-
-    # Добавляем префикс для TON Connect
-    ton_connect_prefix = b"ton-connect"
-    full_msg = b'\xff\xff' + ton_connect_prefix + msg_hash
-
-    # Хэшируем финальное сообщение
-    full_msg_hash = hashlib.sha256(full_msg).digest()
-
-    # Декодируем подпись из base64
-    proof_signature_bytes = base64.b64decode(proof.proof.signature)
-
-    # Проверяем подпись с использованием публичного ключа
-    if not verify_signature(pubkey_bytes, full_msg_hash, proof_signature_bytes):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid signature")
-
-    return proof.address
\ No newline at end of file
+    msg = ton_proof_prefix + wc + address_hash + dl + domain + ts + proof.proof.payload.encode('utf-8')
+
+    # Хэшируем сообщение и добавляем префикс для TON Connect
+    full_msg = b'\xff\xff' + b"ton-connect" + hashlib.sha256(msg).digest()
+
+    # Проверяем подпись хэша финального сообщения публичным ключом
+    signature = base64.b64decode(proof.proof.signature, validate=True)
+    return verify_signature(pubkey_bytes, hashlib.sha256(full_msg).digest(), signature)
+
+
+def rejected(reason: str, detail: str, status_code: int = status.HTTP_400_BAD_REQUEST) -> HTTPException:
+    AUTH_VERIFY_FAILURES.labels(reason).inc()
+    return HTTPException(status_code=status_code, detail=detail)
+
+
+class TonProofVerifier:
+    """
+    Проверка TON Proof для /auth/verify.
+
+    Дешёвые проверки идут на цикле событий: домен, HMAC и срок nonce, окно timestamp, повтор nonce.
+    Разбор ключа и подписи, хэши и ed25519 уходят в пул из workers потоков; одновременно в пуле и в очереди
+    к нему не больше max_pending проверок, остальные ждут queue_wait секунд и получают 503.
+
+    Использованные nonce хранятся в памяти воркера до истечения их срока. Nonce помечается до проверки
+    подписи, чтобы параллельный повтор не прошёл, и освобождается, если подпись не сошлась:
+    чужой запрос с перехваченным nonce не лишает владельца входа.
+    """
+
+    def __init__(
+            self,
+            domains: tuple[str, ...],
+            ttl: int,
+            workers: int,
+            max_pending: int,
+            queue_wait: float,
+            replay_size: int
+    ):
+        self.domains = frozenset(domains)
+        self.ttl = ttl
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_wait = queue_wait
+        self.used_nonces: TTLCache[str, bool] = TTLCache(replay_size, ttl + TON_PROOF_CLOCK_SKEW)
+        self._slots = asyncio.Semaphore(max_pending)
+        self._pool: ThreadPoolExecutor | None = None
+        self.pending = 0
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'used_nonces': len(self.used_nonces),
+        }
+
+    def get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ton-proof')
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    async def verify(self, proof: TonProofItem) -> str:
+        """
+        :return адрес кошелька, подписавшего proof
+        """
+        started = time.perf_counter()
+        try:
+            address = await self._verify(proof)
+        except HTTPException:
+            AUTH_VERIFICATIONS.labels('failure').inc()
+            AUTH_VERIFY_LATENCY.labels('failure').observe(time.perf_counter() - started)
+            raise
+        AUTH_VERIFICATIONS.labels('success').inc()
+        AUTH_VERIFY_LATENCY.labels('success').observe(time.perf_counter() - started)
+        return address
+
+    async def _verify(self, proof: TonProofItem) -> str:
+        domain = proof.proof.domain
+        if domain.value not in self.domains or domain.lengthBytes != len(domain.value.encode('utf-8')):
+            raise rejected('domain', "Unknown domain")
+
+        nonce = proof.proof.payload
+        expires_at = parse_nonce(nonce)
+        if expires_at is None:
+            raise rejected('payload', "Invalid payload")
+        now = time.time()
+        if expires_at < now:
+            raise rejected('payload_expired', "Payload expired")
+        # Подпись не может быть старше выдачи nonce и не должна заметно опережать часы сервера
+        if not expires_at - self.ttl - TON_PROOF_CLOCK_SKEW <= proof.proof.timestamp <= now + TON_PROOF_CLOCK_SKEW:
+            raise rejected('timestamp', "Proof expired")
+        if self.used_nonces.get(nonce):
+            raise rejected('replay', "Payload already used")
+
+        self.used_nonces.set(nonce, True)
+        try:
+            valid = await self._check_signature(proof)
+        except BaseException:
+            self.used_nonces.pop(nonce)
+            raise
+        if not valid:
+            self.used_nonces.pop(nonce)
+            raise rejected('signature', "Invalid signature")
+        return proof.address
+
+    async def _check_signature(self, proof: TonProofItem) -> bool:
+        if not self._slots.locked():
+            await self._slots.acquire()
+        else:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_wait)
+            except asyncio.TimeoutError:
+                raise rejected('busy', "Too many logins, try again later", status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.get_pool(), check_proof_signature, proof)
+        except ValueError:
+            raise rejected('malformed', "Malformed proof")
+        finally:
+            self.pending -= 1
+            self._slots.release()
+
+
+ton_proof_verifier = TonProofVerifier(
+    TON_PROOF_DOMAINS,
+    TON_PROOF_TTL,
+    TON_PROOF_WORKERS,
+    TON_PROOF_MAX_PENDING,
+    TON_PROOF_QUEUE_WAIT,
+    TON_PROOF_REPLAY_SIZE
+)
+REGISTRY.register(StatsCollector('ton_proof', ton_proof_verifier.stats))